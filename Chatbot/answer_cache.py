@@ -0,0 +1,86 @@
+import hashlib
+from typing import List, Optional
+
+import numpy as np
+
+from embedding_cache import normalize_query
+from result_cache import LRUCache
+
+
+def document_ids(documents) -> tuple:
+    """Định danh các tài liệu được truy xuất: movie_id + hash nội dung chunk."""
+    ids = []
+    for doc in documents:
+        digest = hashlib.sha1(doc.page_content.encode('utf-8')).hexdigest()[:12]
+        ids.append(f"{doc.metadata.get('movie_id', '')}:{digest}")
+    return tuple(sorted(ids))
+
+
+class AnswerCache:
+    """
+    Cache câu trả lời của chatbot.
+
+    Khóa gồm các tài liệu được truy xuất và câu hỏi đã chuẩn hóa. Ở chế độ
+    ngữ nghĩa (`semantic_threshold`), câu hỏi mới dùng lại câu trả lời đã có
+    nếu truy xuất ra cùng tài liệu và vector câu hỏi có cosine >= ngưỡng với
+    một câu hỏi đã cache. Cache bị xóa khi vector store được dựng lại.
+    """
+
+    def __init__(self, max_size: int = 512, ttl: Optional[float] = 3600,
+                 semantic_threshold: Optional[float] = None):
+        """
+        Args:
+            max_size: Số câu trả lời tối đa
+            ttl: Thời gian sống (giây) của câu trả lời, None để không hết hạn
+            semantic_threshold: Ngưỡng cosine cho chế độ ngữ nghĩa, None để tắt
+        """
+        self.cache = LRUCache(max_size=max_size, ttl=ttl)
+        self.semantic_threshold = semantic_threshold
+        self.semantic_hits = 0
+        self.index_version = None
+
+    def invalidate(self, index_version):
+        """Xóa cache nếu phiên bản vector store thay đổi."""
+        if index_version != self.index_version:
+            self.cache.clear()
+            self.index_version = index_version
+
+    @staticmethod
+    def _unit(vector) -> Optional[np.ndarray]:
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def get(self, question: str, doc_ids: tuple, query_vector: Optional[List[float]] = None) -> Optional[str]:
+        """Tìm câu trả lời đã cache cho câu hỏi, None nếu không có."""
+        entry = self.cache.get((doc_ids, normalize_query(question)))
+        if entry is not None:
+            return entry[0]
+
+        unit = self._unit(query_vector) if self.semantic_threshold else None
+        if unit is None:
+            return None
+        candidates = [
+            (answer, vector) for (ids, _), (answer, vector) in self.cache.items()
+            if ids == doc_ids and vector is not None
+        ]
+        if not candidates:
+            return None
+        scores = np.stack([vector for _, vector in candidates]) @ unit
+        best = int(np.argmax(scores))
+        if scores[best] >= self.semantic_threshold:
+            self.semantic_hits += 1
+            return candidates[best][0]
+        return None
+
+    def set(self, question: str, doc_ids: tuple, answer: str, query_vector: Optional[List[float]] = None):
+        """Lưu câu trả lời (kèm vector câu hỏi cho chế độ ngữ nghĩa)."""
+        unit = self._unit(query_vector) if self.semantic_threshold else None
+        self.cache.set((doc_ids, normalize_query(question)), (answer, unit))
+
+    def stats(self) -> dict:
+        stats = self.cache.stats()
+        stats['semantic_hits'] = self.semantic_hits
+        return stats
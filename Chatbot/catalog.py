@@ -0,0 +1,105 @@
+import hashlib
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from tfidf_recommender import TfidfRecommender, DEFAULT_CACHE_DIR
+from title_index import TitleIndex
+
+
+def _split_genres(genres_str):
+    if pd.isna(genres_str) or not genres_str:
+        return frozenset()
+    return frozenset(g.strip() for g in genres_str.split(',') if g.strip())
+
+
+def _genre_matrix(genre_sets):
+    """Mã hóa tập thể loại thành ma trận multi-hot (n_phim x n_thể_loại) kiểu bool."""
+    genre_names = tuple(sorted(set().union(*genre_sets))) if genre_sets else ()
+    column_of = {name: i for i, name in enumerate(genre_names)}
+    matrix = np.zeros((len(genre_sets), len(genre_names)), dtype=bool)
+    for row, genres in enumerate(genre_sets):
+        matrix[row, [column_of[g] for g in genres]] = True
+    matrix.setflags(write=False)
+    return genre_names, matrix
+
+
+def _readonly_column(df, column, dtype):
+    """Lấy một cột số dưới dạng mảng NumPy chỉ đọc (NaN nếu thiếu cột)."""
+    if column in df.columns:
+        values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=dtype, na_value=np.nan)
+    else:
+        values = np.full(len(df), np.nan, dtype=dtype)
+    values.setflags(write=False)
+    return values
+
+
+@dataclass(frozen=True, eq=False)
+class CatalogSnapshot:
+    """
+    Ảnh chụp catalog đã tiền xử lý, chỉ đọc.
+
+    Được xây dựng một lần khi tải dữ liệu và dùng chung cho mọi request mà
+    không cần sao chép DataFrame: nội dung TF-IDF, tập thể loại (kèm ma trận
+    multi-hot), mảng rating và chỉ mục tên phim đều đã được tính sẵn.
+    """
+    version: str
+    titles: tuple
+    genres: tuple
+    descriptions: tuple
+    genre_sets: tuple
+    genre_names: tuple
+    genre_matrix: np.ndarray
+    rating_scores: np.ndarray
+    rating_counts: np.ndarray
+    title_index: TitleIndex
+    recommender: TfidfRecommender
+
+    def __len__(self):
+        return len(self.titles)
+
+    @property
+    def empty(self):
+        return len(self.titles) == 0
+
+    @property
+    def tfidf_matrix(self):
+        return self.recommender.tfidf_matrix
+
+
+def build_catalog_snapshot(df, stop_words='english', cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Xây dựng CatalogSnapshot từ DataFrame phim.
+
+    Args:
+        df (DataFrame): DataFrame chứa dữ liệu phim (title, genres, description, rating_score, rating_count)
+        stop_words (list | str | None): Stopwords cho TF-IDF
+        cache_dir (str | None): Thư mục cache ma trận TF-IDF
+
+    Returns:
+        CatalogSnapshot: Ảnh chụp catalog chỉ đọc
+    """
+    df = df.reset_index(drop=True)
+    recommender = TfidfRecommender(df, stop_words=stop_words, cache_dir=cache_dir)
+    genre_sets = tuple(_split_genres(g) for g in recommender.genres)
+    genre_names, genre_matrix = _genre_matrix(genre_sets)
+    rating_scores = _readonly_column(df, 'rating_score', np.float64)
+    rating_counts = _readonly_column(df, 'rating_count', np.float64)
+    # Phiên bản catalog: thay đổi khi nội dung hoặc rating thay đổi (dùng để vô hiệu hóa cache)
+    version = hashlib.sha1(
+        recommender.version.encode('utf-8') + rating_scores.tobytes() + rating_counts.tobytes()
+    ).hexdigest()
+    return CatalogSnapshot(
+        version=version,
+        titles=tuple(recommender.titles),
+        genres=tuple(recommender.genres),
+        descriptions=tuple(recommender.descriptions),
+        genre_sets=genre_sets,
+        genre_names=genre_names,
+        genre_matrix=genre_matrix,
+        rating_scores=rating_scores,
+        rating_counts=rating_counts,
+        title_index=recommender.title_index,
+        recommender=recommender,
+    )
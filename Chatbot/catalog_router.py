@@ -0,0 +1,94 @@
+import re
+from typing import List, Optional
+
+import numpy as np
+
+from title_index import TitleIndex, normalize_title
+from hybrid_retriever import MetadataIndex
+from query_constraints import QueryConstraints, parse_constraints
+
+# Câu hỏi dạng liệt kê/lọc danh sách phim (đã bỏ dấu)
+_LIST_INTENT = re.compile(
+    r'\b(phim nao|bo nao|anime nao|nhung phim|cac phim|tim phim|tim cac|liet ke|danh sach|goi y|de xuat|'
+    r'top|co phim|phim gi|xem phim gi|which|list)\b'
+)
+_NUMBER = re.compile(r'\b(?:top|liet ke|goi y)\s+(\d{1,2})\b')
+# Câu hỏi tìm phim tương tự một phim khác cần LLM/retriever, không lọc catalog được
+_SIMILARITY = re.compile(r'\b(giong|tuong tu|nhu phim|kieu nhu|same as|similar|like)\b')
+
+
+def describe_constraints(constraints: QueryConstraints) -> str:
+    """Mô tả ngắn gọn ràng buộc bằng tiếng Việt, vd. "thể loại Học đường, đang tiến hành"."""
+    parts = []
+    for group in constraints.genres:
+        parts.append("thể loại " + " hoặc ".join(group))
+    if constraints.status:
+        parts.append(constraints.status.lower())
+    if constraints.year is not None:
+        prefix = {'<': 'trước năm', '>': 'sau năm', '>=': 'từ năm'}.get(constraints.year_op, 'năm')
+        parts.append(f"{prefix} {constraints.year}")
+    return ", ".join(parts)
+
+
+class CatalogRouter:
+    """
+    Trả lời trực tiếp các câu hỏi lọc/sắp xếp catalog, không qua LLM.
+
+    Các câu như "Phim nào có rating cao nhất?", "Tìm phim có thể loại Học
+    đường" hay "Có những phim boylove nào đang chiếu?" được nhận diện bằng
+    luật (câu hỏi dạng liệt kê + có ràng buộc thể loại/trạng thái/năm/rating)
+    và trả lời từ chỉ mục dạng cột của catalog (một dòng mỗi phim). Câu hỏi
+    nhắc tới một phim cụ thể ("Top phim hay nhất của Fairy Tail") hoặc tìm
+    phim tương tự ("giống Naruto") và các câu hỏi khác trả về None để đi
+    tiếp qua chain.
+    """
+
+    def __init__(self, metadatas: List[dict], top_n: int = 5):
+        """
+        Args:
+            metadatas: Metadata của từng phim (title, genres, rating, status, episodes, release_year)
+            top_n: Số phim liệt kê mặc định
+        """
+        self.metadatas = metadatas
+        self.index = MetadataIndex(metadatas)
+        self.genre_names = self.index.searchable_genres
+        self.title_index = TitleIndex([metadata.get('title') or '' for metadata in metadatas])
+        self.top_n = top_n
+
+    def constraints(self, question: str) -> Optional[QueryConstraints]:
+        """Ràng buộc của câu hỏi nếu là câu hỏi lọc/sắp xếp catalog, ngược lại None."""
+        text = normalize_title(question)
+        if not _LIST_INTENT.search(text) or _SIMILARITY.search(text) or self.title_index.mentions(question):
+            return None
+        constraints = parse_constraints(question, self.genre_names)
+        return None if constraints.is_empty else constraints
+
+    def search(self, constraints: QueryConstraints, top_n: int) -> List[dict]:
+        """Các phim thỏa ràng buộc, rating giảm dần."""
+        rows = self.index.filter(constraints)
+        if rows is None:
+            rows = np.arange(self.index.size)
+        return [self.metadatas[row] for row in self.index.by_rating(rows)[:top_n]]
+
+    def route(self, question: str) -> Optional[str]:
+        """Câu trả lời trực tiếp cho câu hỏi, hoặc None nếu câu hỏi cần chain/LLM."""
+        constraints = self.constraints(question)
+        if constraints is None:
+            return None
+        count = _NUMBER.search(normalize_title(question))
+        top_n = int(count.group(1)) if count else self.top_n
+        movies = self.search(constraints, top_n)
+
+        description = describe_constraints(constraints)
+        if not movies:
+            return f"Không tìm thấy phim nào {description}." if description else "Không tìm thấy phim nào."
+        header = "Các phim " + (f"{description} " if description else "") + "có rating cao nhất:"
+        lines = [header]
+        for i, movie in enumerate(movies, 1):
+            rating = movie.get('rating') or ['N/A', '0']
+            lines.append(
+                f"{i}. {movie['title']} - {rating[0]}/10 ({rating[1]} lượt đánh giá), "
+                f"{movie.get('status', 'N/A')}, {movie.get('episodes', 'N/A')} tập, "
+                f"năm {movie.get('release_year', 'N/A')} - {', '.join(movie.get('genres') or [])}"
+            )
+        return "\n".join(lines)
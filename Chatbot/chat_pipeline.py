@@ -0,0 +1,146 @@
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage
+
+from question_utils import is_follow_up
+
+STAGES = ('condense', 'retrieve', 'generate')
+
+
+def format_chat_history(chat_history: List) -> str:
+    """Chuyển lịch sử hội thoại (message hoặc cặp hỏi-đáp) thành văn bản cho prompt."""
+    lines = []
+    for turn in chat_history:
+        if isinstance(turn, BaseMessage):
+            role = {'human': 'Human', 'ai': 'Assistant'}.get(turn.type, turn.type)
+            lines.append(f"{role}: {turn.content}")
+        else:
+            lines.append(f"Human: {turn[0]}")
+            lines.append(f"Assistant: {turn[1]}")
+    return "\n".join(lines)
+
+
+def last_question(chat_history: List) -> Optional[str]:
+    """Câu hỏi gần nhất của người dùng trong lịch sử hội thoại."""
+    for turn in reversed(chat_history):
+        if isinstance(turn, HumanMessage):
+            return turn.content
+        if isinstance(turn, tuple):
+            return turn[0]
+    return None
+
+
+class RetrievalChatPipeline:
+    """
+    Pipeline hỏi đáp chỉ gọi LLM một lần mỗi lượt.
+
+    Thay cho ConversationalRetrievalChain (gọi LLM hai lần ở câu hỏi nối
+    tiếp: viết lại câu hỏi rồi trả lời), bước viết lại dùng luật rẻ tiền:
+    câu hỏi độc lập (hoặc lượt đầu) được dùng nguyên văn, không kèm lịch sử;
+    câu hỏi nối tiếp ("Nó có bao nhiêu tập?") được ghép với câu hỏi trước
+    để truy xuất, và lịch sử hội thoại được đưa vào prompt để LLM tự hiểu
+    đại từ. Thời gian từng bước được trả về trong kết quả và cộng dồn trong
+    `stats()`.
+
+    Có cùng giao diện `invoke({"question", "chat_history"})` -> `{"answer", ...}`
+    với chain nên dùng được với StreamingRun; có thể truyền thêm "retrieval"
+    (kết quả `retrieve()`) để dùng lại tài liệu đã truy xuất.
+    """
+
+    def __init__(self, llm, retriever, prompt, history_variable: str = "chat_history", history_header: str = "",
+                 context_builder: Optional[Callable[[List], str]] = None):
+        """
+        Args:
+            llm: LLM sinh câu trả lời
+            retriever: Retriever lấy tài liệu liên quan
+            prompt: PromptTemplate có các biến context, question (và `history_variable` nếu có)
+            history_variable: Tên biến lịch sử hội thoại trong prompt
+            history_header: Dòng tiêu đề đặt trước lịch sử (chỉ khi có lịch sử)
+            context_builder: Hàm ghép tài liệu thành ngữ cảnh (vd. ContextPacker.pack), mặc định nối nguyên văn
+        """
+        self.llm = llm
+        self.retriever = retriever
+        self.prompt = prompt
+        self.history_variable = history_variable if history_variable in prompt.input_variables else None
+        self.history_header = history_header
+        self.context_builder = context_builder or (lambda documents: "\n\n".join(doc.page_content for doc in documents))
+        self._lock = threading.Lock()
+        self._totals = {stage: 0.0 for stage in STAGES + ('total',)}
+        self._calls = 0
+
+    def condense(self, question: str, chat_history: List) -> Tuple[str, bool]:
+        """Câu truy vấn dùng để truy xuất và câu hỏi có phải nối tiếp không (không gọi LLM)."""
+        previous = last_question(chat_history) if chat_history else None
+        if previous and is_follow_up(question):
+            return f"{question} {previous}", True
+        return question, False
+
+    def retrieve(self, question: str, chat_history: Optional[List] = None, config: Optional[dict] = None) -> Dict[str, Any]:
+        """
+        Bước viết lại câu hỏi và truy xuất của một lượt.
+
+        Kết quả có thể truyền lại vào `invoke` qua khóa "retrieval" (vd. sau khi
+        dùng tài liệu làm khóa cache câu trả lời) để không phải truy xuất lại.
+
+        Returns:
+            dict: {"query", "follow_up", "documents", "timings"} (timings tính bằng giây)
+        """
+        chat_history = chat_history or []
+        start = time.perf_counter()
+        query, follow_up = self.condense(question, chat_history)
+        condensed = time.perf_counter()
+        documents = self.retriever.invoke(query, config=config)
+        return {
+            "query": query,
+            "follow_up": follow_up,
+            "documents": documents,
+            "timings": {'condense': condensed - start, 'retrieve': time.perf_counter() - condensed}
+        }
+
+    def invoke(self, inputs: Dict[str, Any], config: Optional[dict] = None) -> Dict[str, Any]:
+        question = inputs["question"]
+        chat_history = inputs.get("chat_history") or []
+        retrieval = inputs.get("retrieval") or self.retrieve(question, chat_history, config)
+        query, follow_up, documents = retrieval["query"], retrieval["follow_up"], retrieval["documents"]
+        timings = dict(retrieval["timings"])
+
+        stage_start = time.perf_counter()
+        prompt_inputs = {
+            "context": self.context_builder(documents),
+            "question": question
+        }
+        if self.history_variable:
+            # Câu hỏi độc lập không cần lịch sử: prompt ngắn hơn, sinh nhanh hơn
+            prompt_inputs[self.history_variable] = (
+                self.history_header + format_chat_history(chat_history) if follow_up else ""
+            )
+        answer = self.llm.invoke(self.prompt.format(**prompt_inputs), config=config)
+        timings['generate'] = time.perf_counter() - stage_start
+        timings['total'] = sum(timings[stage] for stage in STAGES)
+
+        with self._lock:
+            self._calls += 1
+            for stage, seconds in timings.items():
+                self._totals[stage] += seconds
+        return {
+            "question": question,
+            "retrieval_query": query,
+            "answer": answer,
+            "source_documents": documents,
+            "timings": {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}
+        }
+
+    def __call__(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        return self.invoke(inputs)
+
+    def stats(self) -> dict:
+        """Số lượt và thời gian trung bình (ms) của từng bước."""
+        with self._lock:
+            calls = self._calls
+            return {
+                'calls': calls,
+                **{f"{stage}_ms": round(total * 1000 / calls, 1) if calls else 0.0
+                   for stage, total in self._totals.items()}
+            }
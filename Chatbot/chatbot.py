@@ -7,18 +7,23 @@ if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
-from typing import List, Dict
+from typing import Dict
 import mysql.connector
 import pandas as pd
 from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-from langchain_community.llms import HuggingFaceHub
 from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
 
+from vector_index import IncrementalIndexer, model_dir_name
+from embedding_cache import CachedQueryEmbeddings
+from session_memory import SessionMemoryStore
+from llm_backends import create_llm
+from chat_pipeline import RetrievalChatPipeline
+from context_packer import ContextPacker, load_token_counter
+from compact_index import serving_vector_store
+
 # Load biến môi trường từ file .env
 load_dotenv()
 
@@ -30,17 +35,60 @@ DB_CONFIG = {
     'database': os.getenv('DB_NAME', 'movies_db')
 }
 
+# Thư mục lưu FAISS index, phân theo model embedding
+INDEX_BASE_DIR = os.getenv('VECTOR_STORE_DIR', 'vector_store_db')
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# Cấu hình embed theo lô khi dựng index
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 64))
+EMBED_WORKERS = int(os.getenv('EMBED_WORKERS', 0)) or None
+# File .npz lưu cache embedding của câu hỏi, để trống nếu chỉ cache trong bộ nhớ
+QUERY_EMBEDDING_CACHE_PATH = os.getenv('QUERY_EMBEDDING_CACHE_PATH') or None
+# Bộ nhớ hội thoại theo phiên: số lượt giữ nguyên văn, số phiên tối đa, thời gian chờ (giây) trước khi loại phiên
+CHAT_MEMORY_TURNS = int(os.getenv('CHAT_MEMORY_TURNS', 4))
+CHAT_MAX_SESSIONS = int(os.getenv('CHAT_MAX_SESSIONS', 1000))
+CHAT_SESSION_TTL = float(os.getenv('CHAT_SESSION_TTL', 1800)) or None
+# Backend LLM: 'hub' (HuggingFace Inference API), 'tgi' (server text-generation-inference cục bộ)
+# hoặc 'local' (transformers chạy trong tiến trình trên CPU, LLM_QUANTIZE=1 để lượng tử hóa int8)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'hub')
+LLM_ENDPOINT_URL = os.getenv('LLM_ENDPOINT_URL', 'http://localhost:8080')
+LLM_QUANTIZE = os.getenv('LLM_QUANTIZE', '1') == '1'
+# Gom prompt của nhiều người dùng đồng thời thành một lần sinh (backend 'local'): số prompt tối đa, thời gian chờ (ms).
+# Mặc định tắt (1); bật gom lô thì câu trả lời không còn được stream từng token
+LLM_BATCH_SIZE = int(os.getenv('LLM_BATCH_SIZE', 1))
+LLM_BATCH_WAIT_MS = float(os.getenv('LLM_BATCH_WAIT_MS', 20))
+# Pipeline hỏi đáp: 'single' (một lần gọi LLM, viết lại câu hỏi nối tiếp bằng luật)
+# hoặc 'chain' (ConversationalRetrievalChain, gọi LLM viết lại câu hỏi nối tiếp)
+CHAT_PIPELINE = os.getenv('CHAT_PIPELINE', 'single')
+# Ngân sách token cho ngữ cảnh phim trong prompt (pipeline 'single'), đếm bằng tokenizer của model
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 350))
+# Loại FAISS index dùng khi phục vụ: 'flat' (chính xác) hoặc bản nén 'ivf_flat', 'ivf_pq', 'hnsw_sq'
+# cho catalog lớn (xuất từ index flat, docstore mmap không dùng pickle); so sánh: python compact_index.py
+VECTOR_INDEX_TYPE = os.getenv('VECTOR_INDEX_TYPE', 'flat')
+FAISS_NLIST = int(os.getenv('FAISS_NLIST', 0))
+FAISS_PQ_M = int(os.getenv('FAISS_PQ_M', 16))
+FAISS_HNSW_M = int(os.getenv('FAISS_HNSW_M', 32))
+FAISS_NPROBE = int(os.getenv('FAISS_NPROBE', 8))
+FAISS_EF_SEARCH = int(os.getenv('FAISS_EF_SEARCH', 64))
+
 class MovieChatbot:
-    def __init__(self):
+    def __init__(self, index_base_dir: str = INDEX_BASE_DIR):
         """Khởi tạo chatbot với các thành phần cần thiết."""
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
+        self.index_base_dir = index_base_dir
+        # Cache vector của câu hỏi để câu hỏi lặp lại không phải chạy lại model
+        self.embeddings = CachedQueryEmbeddings(
+            HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL),
+            model_name=EMBEDDING_MODEL,
+            persist_path=QUERY_EMBEDDING_CACHE_PATH
         )
         self.vector_store = None
         self.qa_chain = None
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
+        # Lịch sử hội thoại riêng theo phiên/người dùng, có giới hạn kích thước
+        self.memory = SessionMemoryStore(
+            max_sessions=CHAT_MAX_SESSIONS,
+            idle_ttl=CHAT_SESSION_TTL,
+            max_turns=CHAT_MEMORY_TURNS
         )
         
     def load_data_from_db(self) -> pd.DataFrame:
@@ -72,9 +120,9 @@ class MovieChatbot:
             print(f"Lỗi không xác định: {str(e)}")
             return pd.DataFrame()
 
-    def prepare_documents(self, df: pd.DataFrame) -> List[str]:
-        """Chuẩn bị dữ liệu phim thành các đoạn văn bản."""
-        documents = []
+    def prepare_documents(self, df: pd.DataFrame) -> Dict[str, tuple]:
+        """Chuẩn bị dữ liệu phim thành các đoạn văn bản, khóa theo tên phim (duy nhất trong database)."""
+        documents = {}
         for _, row in df.iterrows():
             doc = f"""
             Tên phim: {row['title']}
@@ -83,21 +131,42 @@ class MovieChatbot:
             Điểm đánh giá: {row['rating_score']}
             Số lượt đánh giá: {row['rating_count']}
             """
-            documents.append(doc)
+            documents[row['title']] = (doc, {'movie_id': row['title'], 'title': row['title']})
         return documents
 
-    def create_vector_store(self, documents: List[str]):
-        """Tạo vector store từ các tài liệu."""
+    def create_vector_store(self, documents: Dict[str, tuple]):
+        """
+        Tạo hoặc cập nhật vector store từ các tài liệu.
+
+        Index đã lưu được tải lại và chỉ các phim mới/thay đổi được embed lại;
+        phim bị xóa khỏi database cũng bị xóa khỏi index.
+        """
         # Chunking
         text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP
+        )
+        path = os.path.join(self.index_base_dir, model_dir_name(EMBEDDING_MODEL))
+        indexer = IncrementalIndexer(
+            path=path,
+            model_name=EMBEDDING_MODEL,
+            embeddings=self.embeddings,
+            text_splitter=text_splitter,
+            settings={'model': EMBEDDING_MODEL, 'chunk_size': CHUNK_SIZE, 'chunk_overlap': CHUNK_OVERLAP},
+            batch_size=EMBED_BATCH_SIZE,
+            workers=EMBED_WORKERS
+        )
+        self.vector_store, stats = indexer.sync(documents)
+        print(
+            f"Vector store đã sẵn sàng: thêm {stats['added']}, cập nhật {stats['updated']}, "
+            f"xóa {stats['removed']}, giữ nguyên {stats['unchanged']} phim"
+        )
+        # Phục vụ truy vấn bằng index nén xuất từ index flat vừa cập nhật (nếu VECTOR_INDEX_TYPE khác 'flat')
+        self.vector_store = serving_vector_store(
+            path, VECTOR_INDEX_TYPE, self.embeddings, vector_store=self.vector_store,
+            nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH,
+            nlist=FAISS_NLIST, pq_m=FAISS_PQ_M, hnsw_m=FAISS_HNSW_M
         )
-        texts = text_splitter.create_documents(documents)
-        
-        # Tạo vector store
-        self.vector_store = FAISS.from_documents(texts, self.embeddings)
-        print("Tạo vector store thành công")
 
     def setup_qa_chain(self):
         """Thiết lập chuỗi QA với LLM."""
@@ -117,20 +186,37 @@ class MovieChatbot:
             template=template
         )
 
-        # Khởi tạo LLM từ HuggingFace Hub
-        llm = HuggingFaceHub(
+        # Khởi tạo LLM theo backend được cấu hình (mặc định HuggingFace Hub)
+        llm = create_llm(
+            backend=LLM_BACKEND,
             repo_id="google/flan-t5-base",
-            model_kwargs={"temperature": 0.5, "max_length": 512},
-            huggingfacehub_api_token=os.getenv("HUGGINGFACE_API_TOKEN")
+            api_key=os.getenv("HUGGINGFACE_API_TOKEN"),
+            endpoint_url=LLM_ENDPOINT_URL,
+            temperature=0.5,
+            max_new_tokens=512,
+            quantize=LLM_QUANTIZE,
+            batch_size=LLM_BATCH_SIZE,
+            batch_wait=LLM_BATCH_WAIT_MS / 1000
         )
 
         # Tạo chuỗi QA
-        self.qa_chain = ConversationalRetrievalChain.from_llm(
-            llm=llm,
-            retriever=self.vector_store.as_retriever(),
-            memory=self.memory,
-            combine_docs_chain_kwargs={"prompt": PROMPT}
-        )
+        if CHAT_PIPELINE == 'single':
+            self.qa_chain = RetrievalChatPipeline(
+                llm=llm,
+                retriever=self.vector_store.as_retriever(),
+                prompt=PROMPT,
+                # Làm gọn, gộp chunk cùng phim và xếp ngữ cảnh vào ngân sách token của flan-t5
+                context_builder=ContextPacker(
+                    max_tokens=CONTEXT_TOKEN_BUDGET,
+                    count_tokens=load_token_counter("google/flan-t5-base")
+                ).pack
+            )
+        else:
+            self.qa_chain = ConversationalRetrievalChain.from_llm(
+                llm=llm,
+                retriever=self.vector_store.as_retriever(),
+                combine_docs_chain_kwargs={"prompt": PROMPT}
+            )
 
     def initialize(self):
         """Khởi tạo toàn bộ hệ thống chatbot."""
@@ -144,7 +230,7 @@ class MovieChatbot:
         # Chuẩn bị tài liệu
         documents = self.prepare_documents(df)
         
-        # Tạo vector store
+        # Tải vector store đã lưu và chỉ embed lại các phim mới/thay đổi
         self.create_vector_store(documents)
         
         # Thiết lập QA chain
@@ -152,13 +238,17 @@ class MovieChatbot:
         
         print("Chatbot đã sẵn sàng!")
 
-    def chat(self, question: str) -> str:
-        """Xử lý câu hỏi và trả về câu trả lời."""
+    def chat(self, question: str, session_id: str = "default") -> str:
+        """Xử lý câu hỏi và trả về câu trả lời, dùng lịch sử hội thoại của phiên `session_id`."""
         if not self.qa_chain:
             return "Chatbot chưa được khởi tạo. Vui lòng gọi initialize() trước."
         
         try:
-            response = self.qa_chain({"question": question})
+            response = self.qa_chain({
+                "question": question,
+                "chat_history": self.memory.history(session_id)
+            })
+            self.memory.add_turn(session_id, question, response["answer"])
             return response["answer"]
         except Exception as e:
             return f"Có lỗi xảy ra: {str(e)}"
@@ -177,6 +267,14 @@ def main():
     while True:
         user_input = input("\nBạn: ").strip()
         if user_input.lower() == 'quit':
+            stats = chatbot.embeddings.stats()
+            print(f"Cache embedding câu hỏi: {stats['hits']} hit / {stats['misses']} miss (tỉ lệ hit {stats['hit_rate']:.0%})")
+            if isinstance(chatbot.qa_chain, RetrievalChatPipeline):
+                timings = chatbot.qa_chain.stats()
+                print(
+                    f"Thời gian trung bình ({timings['calls']} lượt): viết lại câu hỏi {timings['condense_ms']} ms, "
+                    f"truy xuất {timings['retrieve_ms']} ms, sinh câu trả lời {timings['generate_ms']} ms"
+                )
             break
             
         response = chatbot.chat(user_input)
@@ -5,27 +5,95 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.vectorstores import FAISS
 from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-from langchain.llms import HuggingFaceHub
 from langchain.prompts import PromptTemplate
 import gradio as gr
 from dotenv import load_dotenv
 
+from vector_index import IncrementalIndexer, read_index_manifest, validate_index_manifest
+from embedding_cache import CachedQueryEmbeddings
+from answer_cache import AnswerCache, document_ids
+from question_utils import is_follow_up
+from session_memory import SessionMemoryStore
+from llm_backends import create_llm
+from streaming import StreamingRun
+from hybrid_retriever import HybridRetriever
+from catalog_router import CatalogRouter
+from chat_pipeline import RetrievalChatPipeline
+from context_packer import ContextPacker, load_token_counter
+from compact_index import serving_vector_store
+
 # Load biến môi trường từ file .env
 load_dotenv()
 
+# Model embedding dùng cho cả dựng index và truy vấn (phải là một)
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# Cấu hình embed theo lô khi dựng index
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 64))
+EMBED_WORKERS = int(os.getenv('EMBED_WORKERS', 0)) or None
+# File .npz lưu cache embedding của câu hỏi, để trống nếu chỉ cache trong bộ nhớ
+QUERY_EMBEDDING_CACHE_PATH = os.getenv('QUERY_EMBEDDING_CACHE_PATH') or None
+# Cache câu trả lời: kích thước, thời gian sống (giây), ngưỡng cosine cho chế độ ngữ nghĩa (để trống để tắt)
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 512))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', 3600)) or None
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.getenv('ANSWER_CACHE_SEMANTIC_THRESHOLD', 0)) or None
+# Bộ nhớ hội thoại theo phiên: số lượt giữ nguyên văn, số phiên tối đa, thời gian chờ (giây) trước khi loại phiên
+CHAT_MEMORY_TURNS = int(os.getenv('CHAT_MEMORY_TURNS', 4))
+CHAT_MAX_SESSIONS = int(os.getenv('CHAT_MAX_SESSIONS', 1000))
+CHAT_SESSION_TTL = float(os.getenv('CHAT_SESSION_TTL', 1800)) or None
+# Backend LLM: 'hub' (HuggingFace Inference API), 'tgi' (server text-generation-inference cục bộ, hỗ trợ streaming)
+# hoặc 'local' (transformers chạy trong tiến trình trên CPU, LLM_QUANTIZE=1 để lượng tử hóa int8)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'hub')
+LLM_ENDPOINT_URL = os.getenv('LLM_ENDPOINT_URL', 'http://localhost:8080')
+LLM_QUANTIZE = os.getenv('LLM_QUANTIZE', '1') == '1'
+# Gom prompt của nhiều người dùng đồng thời thành một lần sinh (backend 'local'): số prompt tối đa, thời gian chờ (ms).
+# Mặc định tắt (1); bật gom lô thì câu trả lời không còn được stream từng token
+LLM_BATCH_SIZE = int(os.getenv('LLM_BATCH_SIZE', 1))
+LLM_BATCH_WAIT_MS = float(os.getenv('LLM_BATCH_WAIT_MS', 20))
+# Pipeline hỏi đáp: 'single' (một lần gọi LLM, viết lại câu hỏi nối tiếp bằng luật)
+# hoặc 'chain' (ConversationalRetrievalChain, gọi LLM viết lại câu hỏi nối tiếp)
+CHAT_PIPELINE = os.getenv('CHAT_PIPELINE', 'single')
+# Ngân sách token cho ngữ cảnh phim trong prompt (pipeline 'single'), đếm bằng tokenizer của model
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 350))
+# Retriever lai: số phim truy xuất (pipeline 'single' lấy nhiều hơn vì ngữ cảnh đã giới hạn theo token),
+# số ứng viên mỗi nguồn, trọng số điểm vector so với BM25
+RETRIEVER_K = int(os.getenv('RETRIEVER_K', 5 if CHAT_PIPELINE == 'single' else 3))
+RETRIEVER_FETCH_K = int(os.getenv('RETRIEVER_FETCH_K', 20))
+HYBRID_ALPHA = float(os.getenv('HYBRID_ALPHA', 0.5))
+# Số phim liệt kê khi trả lời trực tiếp câu hỏi lọc/sắp xếp catalog (không qua LLM)
+ROUTER_TOP_N = int(os.getenv('ROUTER_TOP_N', 5))
+# Loại FAISS index dùng khi phục vụ: 'flat' (chính xác) hoặc bản nén 'ivf_flat', 'ivf_pq', 'hnsw_sq'
+# cho catalog lớn (xuất từ index flat, docstore mmap không dùng pickle); so sánh: python compact_index.py
+VECTOR_INDEX_TYPE = os.getenv('VECTOR_INDEX_TYPE', 'flat')
+FAISS_NLIST = int(os.getenv('FAISS_NLIST', 0))
+FAISS_PQ_M = int(os.getenv('FAISS_PQ_M', 16))
+FAISS_HNSW_M = int(os.getenv('FAISS_HNSW_M', 32))
+FAISS_NPROBE = int(os.getenv('FAISS_NPROBE', 8))
+FAISS_EF_SEARCH = int(os.getenv('FAISS_EF_SEARCH', 64))
+# Tag đánh dấu lần gọi LLM sinh câu trả lời (không stream câu hỏi được viết lại)
+ANSWER_TAG = "answer"
+
 class MovieChatbot:
     def __init__(self, json_path: str = "data/data_movies.json"):
         """Khởi tạo chatbot với dữ liệu phim từ file JSON."""
         self.json_path = json_path
         self.vector_store = None
+        self.embeddings = None
+        self.retriever = None
         self.chain = None
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
+        self.router = None
+        self.answer_cache = AnswerCache(
+            max_size=ANSWER_CACHE_SIZE,
+            ttl=ANSWER_CACHE_TTL,
+            semantic_threshold=ANSWER_CACHE_SEMANTIC_THRESHOLD
+        )
+        # Lịch sử hội thoại riêng cho từng phiên Gradio, có giới hạn kích thước
+        self.memory = SessionMemoryStore(
+            max_sessions=CHAT_MAX_SESSIONS,
+            idle_ttl=CHAT_SESSION_TTL,
+            max_turns=CHAT_MEMORY_TURNS
         )
         self.api_key = os.getenv("HUGGINGFACE_API_TOKEN")
-        if not self.api_key:
+        if not self.api_key and LLM_BACKEND == 'hub':
             raise ValueError("Không tìm thấy HUGGINGFACE_API_KEY trong file .env")
         
     def load_movie_data(self) -> List[Dict]:
@@ -63,8 +131,22 @@ class MovieChatbot:
             print(f"Lỗi khi tải dữ liệu: {str(e)}")
             return []
 
+    def get_embeddings(self) -> CachedQueryEmbeddings:
+        """
+        Khởi tạo (một lần) model embedding dùng chung cho dựng index và truy vấn.
+
+        Vector của câu hỏi được cache nên câu hỏi lặp lại không phải chạy lại model.
+        """
+        if self.embeddings is None:
+            self.embeddings = CachedQueryEmbeddings(
+                HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL),
+                model_name=EMBEDDING_MODEL,
+                persist_path=QUERY_EMBEDDING_CACHE_PATH
+            )
+        return self.embeddings
+
     def create_vector_store(self, save_path: str = "vector_store"):
-        """Tạo và lưu vector store từ dữ liệu phim."""
+        """Tạo hoặc cập nhật (theo movie_id) và lưu vector store từ dữ liệu phim."""
         try:
             movies = self.load_movie_data()
             if not movies:
@@ -75,64 +157,91 @@ class MovieChatbot:
                 chunk_overlap=200
             )
             
-            texts = []
-            metadatas = []
-            for movie in movies:
-                chunks = text_splitter.split_text(movie['text'])
-                texts.extend(chunks)
-                metadatas.extend([movie['metadata']] * len(chunks))
-            
-            #embeddings
-            embeddings = HuggingFaceEmbeddings(
-                model_name="google/flan-t5-large"
+            # Cập nhật vector store đã lưu: chỉ embed phim mới/thay đổi, xóa phim không còn
+            indexer = IncrementalIndexer(
+                path=save_path,
+                model_name=EMBEDDING_MODEL,
+                embeddings=self.get_embeddings(),
+                text_splitter=text_splitter,
+                settings={'model': EMBEDDING_MODEL, 'chunk_size': 1000, 'chunk_overlap': 200},
+                batch_size=EMBED_BATCH_SIZE,
+                workers=EMBED_WORKERS
             )
-            
-            # Tạo vector store
-            self.vector_store = FAISS.from_texts(
-                texts=texts,
-                embedding=embeddings,
-                metadatas=metadatas
+            records = {
+                movie['metadata']['movie_id']: (movie['text'], movie['metadata'])
+                for movie in movies
+            }
+            self.vector_store, stats = indexer.sync(records)
+            self._invalidate_answer_cache(save_path)
+            print(
+                f"Đã lưu vector store tại: {save_path} (thêm {stats['added']}, cập nhật {stats['updated']}, "
+                f"xóa {stats['removed']}, giữ nguyên {stats['unchanged']} phim)"
             )
-            
-            # Lưu vector store
-            if not os.path.exists(save_path):
-                os.makedirs(save_path)
-            self.vector_store.save_local(save_path)
-            print(f"Đã lưu vector store tại: {save_path}")
+            self._use_compact_index(save_path)
             
         except Exception as e:
             print(f"Lỗi khi tạo vector store: {str(e)}")
 
     def load_vector_store(self, load_path: str = "vector_store"):
-        """Tải vector store đã lưu."""
+        """Tải vector store đã lưu, dựng lại nếu index không khớp model embedding đang dùng."""
         try:
-            embeddings = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-            )
-            self.vector_store = FAISS.load_local(
-                load_path, embeddings, allow_dangerous_deserialization=True
-            )
+            embeddings = self.get_embeddings()
+            mismatch = validate_index_manifest(load_path, EMBEDDING_MODEL, embeddings)
+            if mismatch:
+                print(f"Vector store tại {load_path} không dùng được ({mismatch}), đang dựng lại...")
+                self.create_vector_store(load_path)
+                return
+            # Index nén còn khớp thì không cần tải index flat và docstore pickle
+            self.vector_store = None
+            self._use_compact_index(load_path)
+            if self.vector_store is None:
+                self.vector_store = FAISS.load_local(
+                    load_path, embeddings, allow_dangerous_deserialization=True
+                )
+            self._invalidate_answer_cache(load_path)
             print(f"Đã tải vector store từ: {load_path}")
         except Exception as e:
             print(f"Lỗi khi tải vector store: {str(e)}")
 
+    def _use_compact_index(self, path: str):
+        """Chuyển sang index nén (VECTOR_INDEX_TYPE) xuất từ index flat tại `path`, nếu được cấu hình."""
+        self.vector_store = serving_vector_store(
+            path, VECTOR_INDEX_TYPE, self.get_embeddings(), vector_store=self.vector_store,
+            nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH,
+            nlist=FAISS_NLIST, pq_m=FAISS_PQ_M, hnsw_m=FAISS_HNSW_M
+        )
+
+    def _invalidate_answer_cache(self, path: str):
+        """Xóa cache câu trả lời khi vector store được dựng lại hoặc cập nhật."""
+        manifest = read_index_manifest(path) or {}
+        self.answer_cache.invalidate(manifest.get('built_at'))
+
     def setup_chain(self, api_key: str):
             """Thiết lập chuỗi xử lý với LLM."""
             try:
-                llm = HuggingFaceHub(
+                llm_kwargs = dict(
+                    backend=LLM_BACKEND,
                     repo_id="google/flan-t5-large",  # Thay vì declare-lab/flan-alpaca-large
-                    task="text2text-generation",
-                    model_kwargs={"temperature": 0.5, "max_length": 512},
-                    huggingfacehub_api_token=api_key
+                    api_key=api_key,
+                    endpoint_url=LLM_ENDPOINT_URL,
+                    temperature=0.5,
+                    max_new_tokens=512,
+                    quantize=LLM_QUANTIZE,
+                    batch_size=LLM_BATCH_SIZE,
+                    batch_wait=LLM_BATCH_WAIT_MS / 1000
                 )
+                # LLM trả lời stream từng token; LLM viết lại câu hỏi nối tiếp thì không.
+                # Khi gom lô ở backend 'local', câu trả lời được trả về một lần thay vì stream.
+                streaming = not (LLM_BACKEND == 'local' and LLM_BATCH_SIZE > 1)
+                llm = create_llm(streaming=streaming, tags=[ANSWER_TAG], **llm_kwargs)
                 
-                # prompt template
+                # prompt template (lịch sử hội thoại chỉ được điền ở pipeline 'single' với câu hỏi nối tiếp)
                 template = """
                 Bạn là một trợ lý thông minh chuyên về phim ảnh. Hãy trả lời câu hỏi dựa trên thông tin phim được cung cấp.
                 
                 Thông tin phim:
                 {context}
-                
+                {chat_history}
                 Câu hỏi: {question}
                 
                 Trả lời:
@@ -140,47 +249,131 @@ class MovieChatbot:
                 
                 prompt = PromptTemplate(
                     template=template,
-                    input_variables=["context", "question"]
+                    input_variables=["context", "chat_history", "question"]
                 )
                 
-                # Tạo chain
-                self.chain = ConversationalRetrievalChain.from_llm(
-                    llm=llm,
-                    retriever=self.vector_store.as_retriever(
-                        search_kwargs={"k": 3}
-                    ),
-                    memory=self.memory,
-                    combine_docs_chain_kwargs={"prompt": prompt}
+                # Câu hỏi lọc/sắp xếp catalog được trả lời trực tiếp từ metadata phim
+                self.router = CatalogRouter(
+                    [movie['metadata'] for movie in self.load_movie_data()],
+                    top_n=ROUTER_TOP_N
+                )
+                # Lọc theo thể loại/trạng thái/năm/rating rồi kết hợp điểm BM25 và vector
+                self.retriever = HybridRetriever.from_vector_store(
+                    self.vector_store,
+                    k=RETRIEVER_K,
+                    fetch_k=RETRIEVER_FETCH_K,
+                    alpha=HYBRID_ALPHA
                 )
+                
+                # Tạo chain
+                if CHAT_PIPELINE == 'single':
+                    self.chain = RetrievalChatPipeline(
+                        llm=llm,
+                        retriever=self.retriever,
+                        prompt=prompt,
+                        history_header="Lịch sử hội thoại:\n",
+                        # Làm gọn, gộp chunk cùng phim và xếp ngữ cảnh vào ngân sách token của flan-t5
+                        context_builder=ContextPacker(
+                            max_tokens=CONTEXT_TOKEN_BUDGET,
+                            count_tokens=load_token_counter(llm_kwargs['repo_id'])
+                        ).pack
+                    )
+                else:
+                    self.chain = ConversationalRetrievalChain.from_llm(
+                        llm=llm,
+                        retriever=self.retriever,
+                        condense_question_llm=create_llm(**llm_kwargs),
+                        combine_docs_chain_kwargs={"prompt": prompt.partial(chat_history="")}
+                    )
                 return True
                 
             except Exception as e:
                 print(f"Lỗi khi thiết lập chain: {str(e)}")
                 return False
 
-    def chat(self, question: str, history: List[List[str]] = None) -> str:
-        """Xử lý câu hỏi và trả về câu trả lời."""
+    def chat(self, question: str, history: List[List[str]] = None, request: gr.Request = None) -> str:
+        """Xử lý câu hỏi và trả về câu trả lời đầy đủ."""
+        answer = ""
+        for answer in self.chat_stream(question, history, request):
+            pass
+        return answer
+
+    def chat_stream(self, question: str, history: List[List[str]] = None, request: gr.Request = None):
+        """
+        Xử lý câu hỏi và trả về dần câu trả lời (chuỗi tích lũy) khi token được sinh ra.
+
+        Lịch sử hội thoại riêng theo phiên Gradio. Với backend không hỗ trợ
+        streaming, câu trả lời đầy đủ được trả về một lần khi sinh xong.
+        """
         if not self.chain:
-            return "Vui lòng thiết lập API key trước khi chat."
+            yield "Vui lòng thiết lập API key trước khi chat."
+            return
         
+        session_id = request.session_hash if request is not None and request.session_hash else "default"
         try:
-            response = self.chain.invoke({"question": question})
-            return response['answer']
+            # Câu hỏi lọc/sắp xếp (rating cao nhất, theo thể loại/trạng thái/năm) không cần LLM
+            answer = self.router.route(question) if self.router else None
+            if answer is not None:
+                self.memory.add_turn(session_id, question, answer)
+                yield answer
+                return
+
+            # Chỉ cache câu hỏi độc lập; câu hỏi nối tiếp phụ thuộc lịch sử hội thoại
+            cacheable = not is_follow_up(question)
+            chat_history = self.memory.history(session_id)
+            inputs = {"question": question, "chat_history": chat_history}
+            if cacheable:
+                query_vector = self.get_embeddings().embed_query(question)
+                if isinstance(self.chain, RetrievalChatPipeline):
+                    # Truy xuất một lần: tài liệu vừa làm khóa cache vừa được pipeline dùng lại
+                    inputs["retrieval"] = self.chain.retrieve(question, chat_history)
+                    documents = inputs["retrieval"]["documents"]
+                else:
+                    documents = self.retriever.invoke(question)
+                doc_ids = document_ids(documents)
+                answer = self.answer_cache.get(question, doc_ids, query_vector)
+                if answer is not None:
+                    self.memory.add_turn(session_id, question, answer)
+                    yield answer
+                    return
+
+            run = StreamingRun(self.chain, inputs, tag=ANSWER_TAG)
+            partial = ""
+            for token in run:
+                partial += token
+                yield partial
+            answer = run.result['answer']
+            if answer != partial:
+                yield answer
+            timings = run.result.get('timings')
+            if timings:
+                print(
+                    f"Thời gian (ms): viết lại câu hỏi {timings['condense']}, truy xuất {timings['retrieve']}, "
+                    f"sinh câu trả lời {timings['generate']}, tổng {timings['total']}"
+                )
+            self.memory.add_turn(session_id, question, answer)
+            if cacheable:
+                self.answer_cache.set(question, doc_ids, answer, query_vector)
         except Exception as e:
-            return f"Lỗi khi xử lý câu hỏi: {str(e)}"
+            yield f"Lỗi khi xử lý câu hỏi: {str(e)}"
         
+    def pipeline_stats(self) -> dict:
+        """Thời gian trung bình từng bước của pipeline và thống kê cache, hiển thị trên giao diện."""
+        stats = {}
+        if isinstance(self.chain, RetrievalChatPipeline):
+            stats['pipeline'] = self.chain.stats()
+        stats['answer_cache'] = self.answer_cache.stats()
+        stats['sessions'] = self.memory.stats()
+        return stats
+
 def create_chatbot_interface():
     """Tạo giao diện Gradio cho chatbot."""
     try:
         chatbot = MovieChatbot()
         
-        # Tạo vector store mới hoặc tải từ file đã lưu
-        if not os.path.exists("vector_store"):
-            print("Đang tạo vector store mới...")
-            chatbot.create_vector_store()
-        else:
-            print("Đang tải vector store đã lưu...")
-            chatbot.load_vector_store()
+        # Tải vector store đã lưu (tự dựng lại nếu chưa có hoặc không khớp model embedding)
+        print("Đang tải vector store...")
+        chatbot.load_vector_store()
         
         # Thiết lập chain 
         if not chatbot.setup_chain(chatbot.api_key):
@@ -199,7 +392,7 @@ def create_chatbot_interface():
             """)
             
             chatbot_interface = gr.ChatInterface(
-                fn=chatbot.chat,
+                fn=chatbot.chat_stream,
                 title="Chat với Bot",
                 description="Nhập câu hỏi của bạn về anime...",
                 examples=[
@@ -210,6 +403,10 @@ def create_chatbot_interface():
                 ],
                 theme=gr.themes.Soft()
             )
+
+            with gr.Accordion("Thống kê thời gian xử lý", open=False):
+                stats_view = gr.JSON(label="Thời gian trung bình (ms) từng bước")
+                gr.Button("Cập nhật").click(fn=chatbot.pipeline_stats, outputs=stats_view)
         
         return demo
     except Exception as e:
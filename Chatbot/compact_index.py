@@ -0,0 +1,394 @@
+import os
+import json
+import mmap
+import shutil
+import tempfile
+import time
+import argparse
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from vector_index import load_faiss_index, read_index_manifest
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw_sq')
+COMPACT_MANIFEST_FILE = "manifest.json"
+
+
+def _metric(distance_strategy) -> int:
+    if distance_strategy == DistanceStrategy.EUCLIDEAN_DISTANCE:
+        return faiss.METRIC_L2
+    return faiss.METRIC_INNER_PRODUCT
+
+
+def _largest_divisor(d: int, limit: int) -> int:
+    return max(m for m in range(1, min(d, limit) + 1) if d % m == 0)
+
+
+def build_faiss_index(vectors: np.ndarray, index_type: str = 'flat', metric: int = faiss.METRIC_L2,
+                      nlist: int = 0, pq_m: int = 16, hnsw_m: int = 32):
+    """
+    Dựng FAISS index theo loại được chọn và thêm `vectors` vào.
+
+    - 'flat': tìm kiếm chính xác, float32 (4 * d byte mỗi vector)
+    - 'ivf_flat': chia cụm (nlist cụm), chỉ duyệt nprobe cụm gần nhất
+    - 'ivf_pq': chia cụm + nén product quantization (pq_m byte mỗi vector)
+    - 'hnsw_sq': đồ thị HNSW + lượng tử hóa vô hướng 8 bit (d byte mỗi vector)
+
+    Args:
+        vectors: Ma trận vector (n x d)
+        index_type: Một trong INDEX_TYPES
+        metric: faiss.METRIC_L2 hoặc faiss.METRIC_INNER_PRODUCT
+        nlist: Số cụm IVF, 0 để tự chọn theo số vector
+        pq_m: Số sub-quantizer của PQ (được giảm về ước số của d)
+        hnsw_m: Số cạnh mỗi nút HNSW
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, d = vectors.shape
+    if index_type == 'flat':
+        index = faiss.IndexFlat(d, metric)
+    elif index_type in ('ivf_flat', 'ivf_pq'):
+        # Mỗi cụm cần ~39 điểm để huấn luyện k-means ổn định
+        nlist = max(1, min(nlist or int(4 * np.sqrt(n)), n // 39 or 1))
+        quantizer = faiss.IndexFlat(d, metric)
+        if index_type == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, metric)
+        else:
+            # Mỗi mã PQ (2^nbits tâm) cũng cần ~39 điểm huấn luyện mỗi tâm
+            nbits = int(min(8, max(1, np.floor(np.log2(max(n / 39, 2))))))
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, _largest_divisor(d, pq_m), nbits, metric)
+        index.train(vectors)
+    elif index_type == 'hnsw_sq':
+        index = faiss.IndexHNSWSQ(d, faiss.ScalarQuantizer.QT_8bit, hnsw_m, metric)
+        index.train(vectors)
+    else:
+        raise ValueError(f"Loại index không hợp lệ: {index_type} (chọn một trong {', '.join(INDEX_TYPES)})")
+    index.add(vectors)
+    return index
+
+
+def index_params(index_type: str, nlist: int = 0, pq_m: int = 16, hnsw_m: int = 32) -> dict:
+    """Các tham số dựng index có ý nghĩa với `index_type` (dùng để so với manifest)."""
+    return {
+        'ivf_flat': {'nlist': nlist},
+        'ivf_pq': {'nlist': nlist, 'pq_m': pq_m},
+        'hnsw_sq': {'hnsw_m': hnsw_m}
+    }.get(index_type, {})
+
+
+def configure_search(index, nprobe: int = 8, ef_search: int = 64):
+    """Đặt tham số tìm kiếm (số cụm duyệt với IVF, efSearch với HNSW)."""
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    except RuntimeError:
+        pass
+    if hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = ef_search
+    return index
+
+
+def index_size_bytes(index) -> int:
+    return int(faiss.serialize_index(index).size)
+
+
+class CompactDocstore(Docstore):
+    """
+    Docstore chỉ đọc, không dùng pickle.
+
+    Nội dung và metadata của các chunk nằm trong một file JSON lines đọc qua
+    mmap; trong RAM chỉ giữ danh sách id và mảng offset (int64), tài liệu
+    được giải mã khi cần. Gọi `close()` (hoặc dùng `with`) để giải phóng
+    file khi không dùng nữa.
+    """
+
+    DATA_FILE = "docstore.jsonl"
+    OFFSETS_FILE = "docstore_offsets.npy"
+    IDS_FILE = "docstore_ids.json"
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, self.IDS_FILE), 'r', encoding='utf-8') as f:
+            self.ids = json.load(f)
+        self.offsets = np.load(os.path.join(path, self.OFFSETS_FILE))
+        self.position_of = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self._file = open(os.path.join(path, self.DATA_FILE), 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b''
+
+    def close(self):
+        """Đóng mmap và file dữ liệu."""
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = b''
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, '_file'):
+            self.close()
+
+    @classmethod
+    def write(cls, path: str, ids: List[str], documents: Iterable[Document]):
+        """Ghi các tài liệu (theo thứ tự vị trí trong index) ra thư mục `path`."""
+        offsets = [0]
+        with open(os.path.join(path, cls.DATA_FILE), 'wb') as f:
+            for doc in documents:
+                line = json.dumps(
+                    {'page_content': doc.page_content, 'metadata': doc.metadata},
+                    ensure_ascii=False, default=str
+                ).encode('utf-8') + b'\n'
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(os.path.join(path, cls.OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+        with open(os.path.join(path, cls.IDS_FILE), 'w', encoding='utf-8') as f:
+            json.dump(ids, f, ensure_ascii=False)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def document(self, position: int) -> Document:
+        record = json.loads(self._data[self.offsets[position]:self.offsets[position + 1]])
+        return Document(page_content=record['page_content'], metadata=record['metadata'])
+
+    def search(self, search: str):
+        position = self.position_of.get(search)
+        if position is None:
+            return f"ID {search} not found."
+        return self.document(position)
+
+    def add(self, texts):
+        raise RuntimeError("CompactDocstore chỉ đọc, hãy export lại index")
+
+    def delete(self, ids):
+        raise RuntimeError("CompactDocstore chỉ đọc, hãy export lại index")
+
+
+def read_compact_manifest(path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(path, COMPACT_MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def export_compact_index(vector_store: FAISS, path: str, index_type: str, fingerprint: Optional[str] = None,
+                         **params) -> dict:
+    """
+    Xuất vector store (flat, docstore pickle) thành index nén + CompactDocstore tại `path`.
+
+    Vector được lấy lại từ index flat, dựng index loại `index_type`, các tài
+    liệu được ghi theo thứ tự vị trí. `fingerprint` của catalog được ghi vào
+    manifest để biết khi nào cần xuất lại.
+
+    Bản xuất được ghi vào thư mục tạm bên cạnh rồi thay thế `path`, không ghi
+    đè các file mà CompactDocstore đang phục vụ có thể vẫn còn mmap.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=os.path.basename(path) + '.tmp-', dir=parent)
+    try:
+        manifest = _write_compact_index(vector_store, tmp_path, index_type, fingerprint, **params)
+        if os.path.exists(path):
+            # Đổi tên bản cũ trước (os.replace không thay được thư mục khác rỗng);
+            # các file đang được mmap vẫn đọc được cho tới khi đóng
+            old_path = tempfile.mkdtemp(prefix=os.path.basename(path) + '.old-', dir=parent)
+            os.replace(path, os.path.join(old_path, 'export'))
+            os.replace(tmp_path, path)
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return manifest
+
+
+def _write_compact_index(vector_store: FAISS, path: str, index_type: str, fingerprint: Optional[str],
+                         **params) -> dict:
+    n = vector_store.index.ntotal
+    vectors = vector_store.index.reconstruct_n(0, n)
+    index = build_faiss_index(vectors, index_type, _metric(vector_store.distance_strategy), **params)
+    ids = [vector_store.index_to_docstore_id[i] for i in range(n)]
+    faiss.write_index(index, os.path.join(path, "index.faiss"))
+    CompactDocstore.write(path, ids, (vector_store.docstore.search(doc_id) for doc_id in ids))
+    manifest = {
+        'index_type': index_type,
+        'params': params,
+        'fingerprint': fingerprint,
+        'dimension': index.d,
+        'document_count': n,
+        'distance_strategy': str(vector_store.distance_strategy.value),
+        'normalize_L2': bool(vector_store._normalize_L2),
+        'index_bytes': os.path.getsize(os.path.join(path, "index.faiss")),
+        'built_at': datetime.now(timezone.utc).isoformat()
+    }
+    with open(os.path.join(path, COMPACT_MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def load_compact_index(path: str, embeddings, nprobe: int = 8, ef_search: int = 64) -> Optional[FAISS]:
+    """Tải index nén và CompactDocstore thành vector store FAISS của LangChain, None nếu chưa có."""
+    manifest = read_compact_manifest(path)
+    if manifest is None:
+        return None
+    try:
+        index = configure_search(faiss.read_index(os.path.join(path, "index.faiss")), nprobe, ef_search)
+        if manifest['index_type'] in ('ivf_flat', 'ivf_pq'):
+            # Cần ánh xạ id -> vị trí để lấy lại vector (reconstruct) cho retriever lai
+            faiss.extract_index_ivf(index).make_direct_map()
+        docstore = CompactDocstore(path)
+    except (OSError, RuntimeError, ValueError, KeyError) as e:
+        print(f"Không thể tải index nén tại {path}: {e}")
+        return None
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(docstore.ids)),
+        normalize_L2=manifest['normalize_L2'],
+        distance_strategy=DistanceStrategy(manifest['distance_strategy'])
+    )
+
+
+def compact_index_path(flat_path: str, index_type: str) -> str:
+    """Thư mục index nén, nằm trong thư mục của index flat."""
+    return os.path.join(flat_path, f"compact_{index_type}")
+
+
+def compact_vector_store(flat_path: str, index_type: str, embeddings, vector_store: Optional[FAISS] = None,
+                         nprobe: int = 8, ef_search: int = 64, **params) -> Optional[FAISS]:
+    """
+    Vector store nén dùng để phục vụ truy vấn, dựng từ index flat tại `flat_path`.
+
+    Index flat (kèm docstore pickle) vẫn là bản gốc để cập nhật theo movie_id.
+    Index nén được dùng lại nếu cùng loại, tham số và được xuất từ đúng lần
+    lưu hiện tại của index flat (`built_at` trong manifest); khi đó không cần
+    tải index flat. Ngược lại index flat (`vector_store`, hoặc tải từ đĩa)
+    được xuất lại.
+
+    Returns:
+        FAISS | None: Vector store nén, None nếu không dựng được
+    """
+    fingerprint = (read_index_manifest(flat_path) or {}).get('built_at')
+    path = compact_index_path(flat_path, index_type)
+    manifest = read_compact_manifest(path)
+    if not manifest or fingerprint is None or manifest.get('fingerprint') != fingerprint \
+            or manifest.get('index_type') != index_type or manifest.get('params') != params:
+        if vector_store is None:
+            vector_store = load_faiss_index(flat_path, embeddings)
+        if vector_store is None:
+            return None
+        print(f"Đang xuất index {index_type} tại {path}...")
+        manifest = export_compact_index(vector_store, path, index_type, fingerprint, **params)
+    compact = load_compact_index(path, embeddings, nprobe, ef_search)
+    if compact is not None:
+        print(f"Dùng index {index_type}: {manifest['document_count']} vector, {manifest['index_bytes'] / 1024:.0f} KB")
+    return compact
+
+
+def serving_vector_store(flat_path: str, index_type: str, embeddings, vector_store: Optional[FAISS] = None,
+                         nprobe: int = 8, ef_search: int = 64, nlist: int = 0, pq_m: int = 16,
+                         hnsw_m: int = 32) -> Optional[FAISS]:
+    """
+    Vector store dùng để phục vụ truy vấn theo loại index được cấu hình.
+
+    Với 'flat', loại không hợp lệ (có cảnh báo) hoặc khi không dựng được
+    index nén, trả về nguyên `vector_store` (có thể None).
+    """
+    if index_type == 'flat':
+        return vector_store
+    if index_type not in INDEX_TYPES:
+        print(f"Loại index không hợp lệ: {index_type} (chọn một trong {', '.join(INDEX_TYPES)}), dùng index flat")
+        return vector_store
+    compact = compact_vector_store(
+        flat_path, index_type, embeddings, vector_store=vector_store, nprobe=nprobe, ef_search=ef_search,
+        **index_params(index_type, nlist, pq_m, hnsw_m)
+    )
+    return compact if compact is not None else vector_store
+
+
+def evaluate_index_types(vectors: np.ndarray, queries: np.ndarray, index_types=INDEX_TYPES, k: int = 10,
+                         metric: int = faiss.METRIC_L2, nprobe: int = 8, ef_search: int = 64,
+                         **params) -> List[dict]:
+    """
+    So sánh các loại index: recall@k so với tìm kiếm chính xác, độ trễ mỗi truy vấn và kích thước.
+
+    Returns:
+        list: Mỗi phần tử {'index_type', 'recall', 'latency_ms', 'build_s', 'size_bytes'}
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    k = min(k, len(vectors))
+    exact = faiss.IndexFlat(vectors.shape[1], metric)
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    results = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = configure_search(build_faiss_index(vectors, index_type, metric, **params), nprobe, ef_search)
+        build_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        # Đo từng truy vấn riêng lẻ như khi phục vụ chatbot
+        found = np.vstack([index.search(queries[i:i + 1], k)[1] for i in range(len(queries))])
+        latency = (time.perf_counter() - start) / len(queries)
+        recall = np.mean([len(np.intersect1d(found[i], truth[i])) / k for i in range(len(queries))])
+        results.append({
+            'index_type': index_type,
+            'recall': float(recall),
+            'latency_ms': latency * 1000,
+            'build_s': build_seconds,
+            'size_bytes': index_size_bytes(index)
+        })
+    return results
+
+
+def _load_vectors(path: str) -> Tuple[np.ndarray, int]:
+    """Đọc vector từ index.faiss đã lưu (không cần tải docstore pickle)."""
+    index = faiss.read_index(os.path.join(path, "index.faiss"))
+    return index.reconstruct_n(0, index.ntotal), index.metric_type
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đánh giá recall/độ trễ các loại FAISS index trên vector store đã lưu")
+    parser.add_argument('path', nargs='?', default="vector_store", help="Thư mục chứa index.faiss")
+    parser.add_argument('--k', type=int, default=10, help="Số kết quả dùng để tính recall@k")
+    parser.add_argument('--queries', type=int, default=200, help="Số truy vấn lấy mẫu")
+    parser.add_argument('--replicate', type=int, default=1,
+                        help="Nhân bản catalog (có nhiễu) để mô phỏng catalog lớn hơn")
+    parser.add_argument('--nprobe', type=int, default=8)
+    parser.add_argument('--ef-search', type=int, default=64)
+    args = parser.parse_args()
+
+    vectors, metric = _load_vectors(args.path)
+    rng = np.random.default_rng(0)
+    if args.replicate > 1:
+        noise = vectors.std() * 0.1
+        vectors = np.vstack([vectors] + [
+            vectors + rng.normal(0, noise, vectors.shape).astype(np.float32) for _ in range(args.replicate - 1)
+        ])
+    # Truy vấn: các vector trong catalog có thêm nhiễu nhỏ
+    sample = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    queries = sample + rng.normal(0, vectors.std() * 0.05, sample.shape).astype(np.float32)
+
+    print(f"{len(vectors)} vector, {vectors.shape[1]} chiều, {len(queries)} truy vấn, recall@{args.k}")
+    print(f"{'index':<10}{'recall':>8}{'ms/truy vấn':>14}{'dựng (s)':>10}{'kích thước':>14}")
+    for result in evaluate_index_types(vectors, queries, k=args.k, metric=metric,
+                                       nprobe=args.nprobe, ef_search=args.ef_search):
+        print(
+            f"{result['index_type']:<10}{result['recall']:>8.3f}{result['latency_ms']:>14.3f}"
+            f"{result['build_s']:>10.2f}{result['size_bytes'] / 1024:>11.0f} KB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import re
+from typing import Callable, List, Optional
+
+# Giá trị giữ chỗ crawler ghi khi thiếu dữ liệu
+_PLACEHOLDERS = {'n/a', 'na', 'none', 'nan', 'null', ''}
+_FIELD_LINE = re.compile(r'^([^:]{1,40}):\s*(.*)$')
+_WHITESPACE = re.compile(r'[ \t]+')
+
+
+def clean_chunk(text: str) -> List[str]:
+    """
+    Bỏ phần thừa trong một chunk: khoảng trắng đầu dòng, dòng trống và các
+    trường chỉ có giá trị giữ chỗ (vd. "Mô tả: N/A").
+
+    Returns:
+        list: Các dòng còn lại
+    """
+    lines = []
+    for line in text.splitlines():
+        line = _WHITESPACE.sub(' ', line).strip()
+        if not line:
+            continue
+        field = _FIELD_LINE.match(line)
+        if field and field.group(2).strip().casefold() in _PLACEHOLDERS:
+            continue
+        if line.casefold() in _PLACEHOLDERS:
+            continue
+        lines.append(line)
+    return lines
+
+
+def approximate_token_count(text: str) -> int:
+    """Ước lượng số token khi không có tokenizer (khoảng 4 ký tự một token)."""
+    return (len(text) + 3) // 4
+
+
+def load_token_counter(model_name: str) -> Callable[[str], int]:
+    """Hàm đếm token bằng tokenizer của model, ước lượng nếu không tải được tokenizer."""
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+    except Exception as e:
+        print(f"Không tải được tokenizer {model_name}, ước lượng số token theo độ dài: {e}")
+        return approximate_token_count
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+class ContextPacker:
+    """
+    Ghép các tài liệu truy xuất được thành ngữ cảnh trong giới hạn token.
+
+    Tài liệu được xét theo thứ tự điểm (tốt nhất trước). Các chunk cùng
+    `movie_id` được gộp lại, bỏ các dòng trùng (do chunk overlap). Mỗi phim
+    được thêm nguyên vẹn nếu còn đủ token; phim đầu tiên không vừa được cắt
+    bớt (dòng cuối, rồi từ cuối) cho vừa phần còn lại và dừng ở đó.
+    """
+
+    def __init__(self, max_tokens: int = 350, count_tokens: Optional[Callable[[str], int]] = None,
+                 separator: str = "\n\n"):
+        """
+        Args:
+            max_tokens: Số token tối đa của ngữ cảnh
+            count_tokens: Hàm đếm token (tokenizer của model đích), mặc định ước lượng
+            separator: Chuỗi ngăn cách giữa các phim
+        """
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens or approximate_token_count
+        self.separator = separator
+
+    def group(self, documents) -> List[List[str]]:
+        """Gộp chunk theo movie_id (giữ thứ tự xuất hiện đầu tiên), bỏ dòng trùng."""
+        movies = {}
+        for position, doc in enumerate(documents):
+            key = doc.metadata.get('movie_id', f"#{position}")
+            lines = movies.setdefault(key, [])
+            seen = set(lines)
+            for line in clean_chunk(doc.page_content):
+                if line not in seen:
+                    seen.add(line)
+                    lines.append(line)
+        return [lines for lines in movies.values() if lines]
+
+    def fit(self, lines: List[str], budget: int) -> Optional[str]:
+        """Khối văn bản của một phim trong `budget` token: bỏ dòng cuối, cắt bớt từ ở dòng cuối còn lại."""
+        block = "\n".join(lines)
+        if self.count_tokens(block) <= budget:
+            return block
+        while len(lines) > 1 and self.count_tokens("\n".join(lines[:-1])) > budget:
+            lines = lines[:-1]
+        head = "\n".join(lines[:-1] + [''])
+        words = lines[-1].split(' ')
+        # Tìm nhị phân số từ nhiều nhất của dòng cuối còn vừa ngân sách
+        low, high = 0, len(words) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(head + ' '.join(words[:middle]) + '…') <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        if low:
+            return head + ' '.join(words[:low]) + '…'
+        head = head.rstrip('\n')
+        return head if head and self.count_tokens(head) <= budget else None
+
+    def pack(self, documents) -> str:
+        """Ngữ cảnh đã làm gọn, không vượt quá `max_tokens` token."""
+        blocks = []
+        used = 0
+        separator_tokens = self.count_tokens(self.separator)
+        for lines in self.group(documents):
+            budget = self.max_tokens - used - (separator_tokens if blocks else 0)
+            if budget <= 0:
+                break
+            block = self.fit(lines, budget)
+            if block is None:
+                break
+            used += self.count_tokens(block) + (separator_tokens if blocks else 0)
+            blocks.append(block)
+            if block != "\n".join(lines):
+                break
+        return self.separator.join(blocks)
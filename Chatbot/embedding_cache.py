@@ -0,0 +1,102 @@
+import os
+import re
+import json
+import atexit
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from result_cache import LRUCache
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_query(text: str) -> str:
+    """Chuẩn hóa câu hỏi làm khóa cache: bỏ khoảng trắng thừa, chữ thường."""
+    return _WHITESPACE.sub(' ', text).strip().casefold()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Bọc một model embedding, cache vector của câu truy vấn theo câu đã chuẩn hóa.
+
+    Câu hỏi lặp lại (kể cả khác hoa thường/khoảng trắng) không phải chạy lại
+    model. embed_documents (dùng khi dựng index) không được cache. Nếu có
+    `persist_path`, cache được tải khi khởi tạo và lưu lại khi thoát chương trình.
+    """
+
+    def __init__(self, base: Embeddings, model_name: str = '', max_size: int = 4096,
+                 ttl: Optional[float] = None, persist_path: Optional[str] = None):
+        """
+        Args:
+            base: Model embedding gốc
+            model_name: Tên model, dùng để không tải nhầm cache của model khác
+            max_size: Số câu truy vấn tối đa trong cache
+            ttl: Thời gian sống (giây) của mỗi vector, None để không hết hạn
+            persist_path: File .npz để lưu cache xuống đĩa (đuôi .npz), None để tắt
+        """
+        self.base = base
+        self.model_name = model_name
+        self.cache = LRUCache(max_size=max_size, ttl=ttl)
+        self.persist_path = persist_path
+        if persist_path:
+            self.load()
+            atexit.register(self.save)
+
+    def __getattr__(self, name):
+        # Giữ nguyên các thuộc tính của model gốc (encode_kwargs, client...)
+        if name == 'base':
+            raise AttributeError(name)
+        return getattr(self.base, name)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.base.embed_query(text)
+            self.cache.set(key, vector)
+        return list(vector)
+
+    def stats(self) -> dict:
+        """Thống kê hit/miss của cache."""
+        return self.cache.stats()
+
+    def save(self):
+        """Lưu cache xuống đĩa (khóa, vector) dưới dạng .npz."""
+        if not self.persist_path or not len(self.cache):
+            return
+        items = self.cache.items()
+        try:
+            directory = os.path.dirname(self.persist_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            np.savez(
+                self.persist_path,
+                model_name=np.array(self.model_name),
+                keys=np.array(json.dumps([key for key, _ in items], ensure_ascii=False)),
+                vectors=np.asarray([value for _, value in items], dtype=np.float32)
+            )
+        except OSError as e:
+            print(f"Không thể lưu cache embedding: {e}")
+
+    def load(self):
+        """Tải cache đã lưu nếu được tạo bởi cùng model."""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with np.load(self.persist_path) as data:
+                if str(data['model_name']) != self.model_name:
+                    print("Cache embedding trên đĩa thuộc model khác, bỏ qua.")
+                    return
+                keys = json.loads(str(data['keys']))
+                vectors = data['vectors']
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Không thể tải cache embedding: {e}")
+            return
+        for key, vector in zip(keys, vectors):
+            self.cache.set(key, vector.tolist())
+        print(f"Đã tải {len(keys)} vector truy vấn từ cache.")
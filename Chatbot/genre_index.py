@@ -0,0 +1,109 @@
+import re
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from title_index import normalize_title
+
+# "Hành động + Học đường" -> AND, "Hành động, Học đường" hoặc "a | b" -> OR
+_AND_SEPARATOR = re.compile(r'\s*[+&]\s*')
+_OR_SEPARATOR = re.compile(r'\s*[,|]\s*')
+
+
+def parse_genre_query(query):
+    """
+    Tách chuỗi thể loại người dùng nhập thành (danh sách thể loại, chế độ).
+
+    Returns:
+        tuple: (list thể loại, 'and' hoặc 'or')
+    """
+    if _AND_SEPARATOR.search(query):
+        return [g for g in _AND_SEPARATOR.split(query) if g.strip()], 'and'
+    return [g for g in _OR_SEPARATOR.split(query) if g.strip()], 'or'
+
+
+class GenreIndex:
+    """
+    Chỉ mục ngược thể loại -> danh sách phim, sắp xếp sẵn theo rating.
+
+    Mỗi phim được gán một thứ hạng toàn cục theo rating_score giảm dần (phim
+    thiếu rating xếp cuối). Danh sách của mỗi thể loại là mảng thứ hạng tăng
+    dần, nên truy vấn AND/OR nhiều thể loại chỉ là phép giao/hợp các mảng đã
+    sắp xếp và N phần tử đầu tiên chính là top N, không cần sort lại.
+    """
+
+    def __init__(self, df):
+        """
+        Args:
+            df (DataFrame): DataFrame chứa dữ liệu phim (title, genres, description, rating_score)
+        """
+        df = df.reset_index(drop=True)
+        self.titles = df['title'].tolist()
+        self.genres = df['genres'].tolist()
+        self.descriptions = df['description'].tolist()
+        if 'rating_score' in df.columns:
+            rating_scores = pd.to_numeric(df['rating_score'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            rating_scores = np.full(len(df), np.nan)
+        self.rating_scores = rating_scores
+
+        # Thứ hạng toàn cục: rating giảm dần, thiếu rating xếp cuối
+        self._row_of_rank = np.lexsort((-np.nan_to_num(rating_scores, nan=0.0), np.isnan(rating_scores))).astype(np.int32)
+
+        postings = {}
+        display_names = {}
+        for rank, row in enumerate(self._row_of_rank):
+            genres_str = self.genres[row]
+            if not isinstance(genres_str, str):
+                continue
+            for genre in genres_str.split(','):
+                key = normalize_title(genre)
+                if not key:
+                    continue
+                display_names.setdefault(key, genre.strip())
+                postings.setdefault(key, []).append(rank)
+
+        self._postings = {key: np.asarray(ranks, dtype=np.int32) for key, ranks in postings.items()}
+        self._display_names = display_names
+        self.genre_names = sorted(display_names.values())
+
+    def __contains__(self, genre):
+        return normalize_title(genre) in self._postings
+
+    def _ranks(self, genres, mode):
+        postings = [self._postings.get(normalize_title(g)) for g in genres]
+        if mode == 'and':
+            if not postings or any(p is None for p in postings):
+                return np.empty(0, dtype=np.int32)
+            return reduce(lambda a, b: np.intersect1d(a, b, assume_unique=True), postings)
+        postings = [p for p in postings if p is not None]
+        if not postings:
+            return np.empty(0, dtype=np.int32)
+        return reduce(np.union1d, postings)
+
+    def query(self, genres, top_n=10, mode='or'):
+        """
+        Gợi ý phim theo một hoặc nhiều thể loại.
+
+        Args:
+            genres (str | list): Thể loại hoặc danh sách thể loại
+            top_n (int): Số lượng phim gợi ý
+            mode (str): 'and' (có tất cả thể loại) hoặc 'or' (có ít nhất một)
+
+        Returns:
+            list: Danh sách các phim được gợi ý, rating giảm dần
+        """
+        if isinstance(genres, str):
+            genres = [genres]
+        ranks = self._ranks(genres, mode)[:top_n]
+
+        recommendations = []
+        for row in self._row_of_rank[ranks]:
+            recommendations.append({
+                'title': self.titles[row],
+                'genres': self.genres[row],
+                'description': self.descriptions[row],
+                'rating_score': float(self.rating_scores[row])
+            })
+        return recommendations
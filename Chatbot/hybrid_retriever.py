@@ -0,0 +1,243 @@
+import re
+from functools import reduce
+from typing import Any, List, Optional
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from title_index import TitleIndex, normalize_title
+from query_constraints import QueryConstraints, parse_constraints
+
+_TOKEN = re.compile(r'[0-9a-z]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Tách từ cho BM25: bỏ dấu, chữ thường, theo âm tiết."""
+    return _TOKEN.findall(normalize_title(text))
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class BM25Index:
+    """
+    Chỉ mục BM25 trên các chunk, trọng số tính sẵn trong ma trận thưa.
+
+    Điểm của một truy vấn là tổng các cột (từ) của truy vấn, nên chấm điểm cả
+    catalog chỉ là một phép cộng cột trên ma trận CSC.
+    """
+
+    def __init__(self, texts: List[str], k1: float = 1.5, b: float = 0.75):
+        self.vectorizer = CountVectorizer(tokenizer=tokenize, lowercase=False, token_pattern=None)
+        tf = self.vectorizer.fit_transform(texts).tocoo()
+        n_docs = tf.shape[0]
+        doc_len = np.asarray(tf.sum(axis=1)).ravel()
+        avg_len = doc_len.mean() if n_docs else 0.0
+        df = np.bincount(tf.col, minlength=tf.shape[1])
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+        norm = k1 * (1 - b + b * doc_len / avg_len) if avg_len else np.full(n_docs, k1)
+        weights = idf[tf.col] * tf.data * (k1 + 1) / (tf.data + norm[tf.row])
+        self.weights = sparse.csc_matrix((weights, (tf.row, tf.col)), shape=tf.shape)
+        self.vocabulary = self.vectorizer.vocabulary_
+
+    def scores(self, query: str) -> np.ndarray:
+        """Điểm BM25 của mọi chunk với truy vấn."""
+        columns = sorted({self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary})
+        if not columns:
+            return np.zeros(self.weights.shape[0])
+        return np.asarray(self.weights[:, columns].sum(axis=1)).ravel()
+
+
+class MetadataIndex:
+    """
+    Chỉ mục metadata theo vị trí vector trong FAISS: thể loại -> danh sách vị
+    trí (đã sắp xếp), mảng trạng thái, năm phát hành, rating.
+
+    Lọc theo ràng buộc chỉ là giao/hợp các mảng và so sánh trên mảng NumPy.
+    """
+
+    def __init__(self, metadatas: List[dict]):
+        n = len(metadatas)
+        postings = {}
+        self.genre_names = {}
+        statuses = []
+        self.years = np.full(n, -1, dtype=np.int32)
+        self.ratings = np.full(n, np.nan)
+        self.rating_counts = np.zeros(n)
+        for row, metadata in enumerate(metadatas):
+            for genre in metadata.get('genres') or []:
+                key = normalize_title(genre)
+                self.genre_names.setdefault(key, genre)
+                postings.setdefault(key, []).append(row)
+            statuses.append(metadata.get('status') or '')
+            year = _to_float(metadata.get('release_year'))
+            if not np.isnan(year):
+                self.years[row] = int(year)
+            rating = metadata.get('rating') or []
+            if len(rating) > 0:
+                self.ratings[row] = _to_float(rating[0])
+            if len(rating) > 1:
+                self.rating_counts[row] = np.nan_to_num(_to_float(rating[1]))
+        self.postings = {key: np.asarray(rows, dtype=np.int64) for key, rows in postings.items()}
+        self.statuses = np.asarray(statuses, dtype=object)
+        self.size = n
+
+    @property
+    def searchable_genres(self) -> List[str]:
+        """Thể loại dùng để lọc: bỏ các thể loại quá chung (có ở hơn nửa catalog, vd. 'Anime')."""
+        return [
+            name for key, name in self.genre_names.items()
+            if len(self.postings[key]) <= self.size / 2
+        ]
+
+    def filter(self, constraints: QueryConstraints) -> Optional[np.ndarray]:
+        """Vị trí các chunk thỏa ràng buộc, None nếu không có ràng buộc lọc."""
+        if not constraints.has_filters:
+            return None
+        rows = np.arange(self.size, dtype=np.int64)
+        for group in constraints.genres:
+            group_rows = [self.postings.get(normalize_title(g), np.empty(0, dtype=np.int64)) for g in group]
+            rows = np.intersect1d(rows, reduce(np.union1d, group_rows), assume_unique=True)
+        mask = np.ones(len(rows), dtype=bool)
+        if constraints.status is not None:
+            mask &= self.statuses[rows] == constraints.status
+        if constraints.year is not None:
+            years = self.years[rows]
+            op = constraints.year_op
+            if op == '<':
+                mask &= (years >= 0) & (years < constraints.year)
+            elif op == '>':
+                mask &= years > constraints.year
+            elif op == '>=':
+                mask &= years >= constraints.year
+            else:
+                mask &= years == constraints.year
+        return rows[mask]
+
+    def by_rating(self, rows: np.ndarray) -> np.ndarray:
+        """Sắp xếp vị trí theo rating giảm dần (rồi số lượt đánh giá), thiếu rating xếp cuối."""
+        ratings = self.ratings[rows]
+        order = np.lexsort((-self.rating_counts[rows], -np.nan_to_num(ratings, nan=0.0), np.isnan(ratings)))
+        return rows[order]
+
+
+def _min_max(values: np.ndarray) -> np.ndarray:
+    if not len(values):
+        return values
+    low, high = values.min(), values.max()
+    return (values - low) / (high - low) if high > low else np.ones_like(values)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever kết hợp lọc metadata, BM25 và tìm kiếm vector.
+
+    1. Trích ràng buộc (thể loại, trạng thái, năm, xếp theo rating) từ câu hỏi.
+    2. Lọc trước bằng MetadataIndex; nếu không có ràng buộc, lấy ứng viên là
+       `fetch_k` kết quả tốt nhất của FAISS và của BM25.
+    3. Chấm điểm vector các ứng viên (vector lấy lại từ FAISS theo vị trí) và
+       kết hợp với điểm BM25: alpha * vector + (1 - alpha) * BM25 (đã chuẩn hóa),
+       rating dùng để phân định khi bằng điểm.
+       Câu hỏi so sánh nhất ("phim nào hay nhất") không nhắc tới phim cụ thể
+       được sắp theo rating thay vì độ liên quan; nếu có tên phim ("One Piece
+       có hay nhất không?") vẫn xếp theo độ liên quan.
+    Mỗi phim chỉ trả về chunk tốt nhất.
+    """
+
+    vector_store: Any
+    metadata_index: Any
+    bm25: Any
+    title_index: Any = None
+    k: int = 3
+    fetch_k: int = 20
+    alpha: float = 0.5
+
+    @classmethod
+    def from_vector_store(cls, vector_store, k: int = 3, fetch_k: int = 20, alpha: float = 0.5) -> 'HybridRetriever':
+        """
+        Dựng các chỉ mục metadata và BM25 một lần từ vector store (theo thứ tự vị
+        trí trong FAISS). Tài liệu không được giữ lại, chỉ đọc từ docstore khi trả kết quả.
+        """
+        ids = vector_store.index_to_docstore_id
+        metadatas, texts = [], []
+        for i in range(len(ids)):
+            document = vector_store.docstore.search(ids[i])
+            metadatas.append(document.metadata)
+            texts.append(document.page_content)
+        return cls(
+            vector_store=vector_store,
+            metadata_index=MetadataIndex(metadatas),
+            bm25=BM25Index(texts),
+            title_index=TitleIndex([metadata.get('title') or '' for metadata in metadatas]),
+            k=k,
+            fetch_k=fetch_k,
+            alpha=alpha
+        )
+
+    def constraints(self, question: str) -> QueryConstraints:
+        return parse_constraints(question, self.metadata_index.searchable_genres)
+
+    def mentions_title(self, question: str) -> bool:
+        """Câu hỏi có nhắc tới tên một phim trong catalog không."""
+        return self.title_index is not None and bool(self.title_index.mentions(question))
+
+    def _query_vector(self, query: str) -> np.ndarray:
+        vector = np.asarray([self.vector_store._embed_query(query)], dtype=np.float32)
+        if self.vector_store._normalize_L2:
+            vector /= np.linalg.norm(vector, axis=1, keepdims=True)
+        return vector
+
+    def _vector_scores(self, query_vector: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Điểm tương đồng (càng lớn càng gần) giữa truy vấn và các vector ở vị trí `rows`."""
+        vectors = self.vector_store.index.reconstruct_batch(rows.astype(np.int64))
+        if self.vector_store.distance_strategy == DistanceStrategy.EUCLIDEAN_DISTANCE:
+            return -((vectors - query_vector) ** 2).sum(axis=1)
+        return vectors @ query_vector[0]
+
+    def _top_documents(self, rows: np.ndarray) -> List[Document]:
+        """`k` tài liệu đầu tiên theo thứ tự `rows`, mỗi phim chỉ lấy chunk tốt nhất."""
+        documents, seen = [], set()
+        for row in rows:
+            document = self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[int(row)])
+            movie_id = document.metadata.get('movie_id', row)
+            if movie_id in seen:
+                continue
+            seen.add(movie_id)
+            documents.append(document)
+            if len(documents) == self.k:
+                break
+        return documents
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        constraints = self.constraints(query)
+        candidates = self.metadata_index.filter(constraints)
+        if candidates is not None and not len(candidates):
+            return []
+
+        if constraints.sort_by_rating and not self.mentions_title(query):
+            rows = candidates if candidates is not None else np.arange(self.metadata_index.size)
+            return self._top_documents(self.metadata_index.by_rating(rows))
+
+        bm25_scores = self.bm25.scores(query)
+        query_vector = self._query_vector(query)
+        if candidates is None:
+            n = min(self.fetch_k, self.metadata_index.size)
+            _, vector_rows = self.vector_store.index.search(query_vector, n)
+            bm25_rows = np.argpartition(-bm25_scores, n - 1)[:n] if n else np.empty(0, dtype=np.int64)
+            candidates = np.union1d(vector_rows[0][vector_rows[0] >= 0], bm25_rows)
+
+        fused = (
+            self.alpha * _min_max(self._vector_scores(query_vector, candidates))
+            + (1 - self.alpha) * _min_max(bm25_scores[candidates])
+        )
+        ratings = np.nan_to_num(self.metadata_index.ratings[candidates], nan=0.0)
+        return self._top_documents(candidates[np.lexsort((-ratings, -fused))])
@@ -0,0 +1,286 @@
+import threading
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import Generation, GenerationChunk, LLMResult
+from langchain_community.llms import HuggingFaceHub
+
+from micro_batcher import MicroBatcher
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+LLM_BACKENDS = ('hub', 'tgi', 'local')
+
+# Model cục bộ đã tải, dùng chung cho mọi instance: (tên model, lượng tử hóa) -> LocalModel
+_LOCAL_MODELS = {}
+_LOCAL_MODELS_LOCK = threading.Lock()
+# Bộ gom lô dùng chung cho các instance cùng model và tham số sinh
+_BATCHERS = {}
+
+
+class LocalModel:
+    """Tokenizer + model transformers đã tải lên CPU (seq2seq hoặc causal)."""
+
+    def __init__(self, model_name: str, quantize: bool = True):
+        from transformers import AutoConfig, AutoModelForCausalLM, AutoModelForSeq2SeqLM, AutoTokenizer
+
+        if torch is None:
+            raise ImportError("Backend 'local' cần cài torch và transformers")
+        self.model_name = model_name
+        self.is_seq2seq = bool(getattr(AutoConfig.from_pretrained(model_name), 'is_encoder_decoder', False))
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model_cls = AutoModelForSeq2SeqLM if self.is_seq2seq else AutoModelForCausalLM
+        model = model_cls.from_pretrained(model_name)
+        if not self.is_seq2seq:
+            # Model causal: pad bên trái để token sinh ra nối liền sau prompt
+            self.tokenizer.padding_side = 'left'
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+        model.eval()
+        self.quantized = False
+        if quantize:
+            try:
+                # Lượng tử hóa động int8 cho các lớp Linear: nhỏ hơn ~4 lần, nhanh hơn trên CPU
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                self.quantized = True
+            except (RuntimeError, AssertionError) as e:
+                print(f"Không thể lượng tử hóa {model_name}, dùng trọng số float32: {e}")
+        self.model = model
+        # model.generate không an toàn khi gọi đồng thời trên cùng model
+        self.lock = threading.Lock()
+
+    def _generate_kwargs(self, max_new_tokens: int, temperature: float) -> dict:
+        kwargs = {'max_new_tokens': max_new_tokens, 'pad_token_id': self.tokenizer.pad_token_id}
+        if temperature > 0:
+            kwargs.update(do_sample=True, temperature=temperature)
+        return kwargs
+
+    def generate(self, prompts: List[str], max_new_tokens: int = 512, temperature: float = 0.5,
+                 streamer=None) -> List[str]:
+        """Sinh câu trả lời cho nhiều prompt trong một lần gọi model (một batch có padding)."""
+        inputs = self.tokenizer(prompts, return_tensors='pt', padding=True, truncation=True)
+        with self.lock, torch.inference_mode():
+            outputs = self.model.generate(
+                **inputs, streamer=streamer, **self._generate_kwargs(max_new_tokens, temperature)
+            )
+        if not self.is_seq2seq:
+            # Bỏ phần prompt, chỉ giữ token mới sinh
+            outputs = outputs[:, inputs['input_ids'].shape[1]:]
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+
+def load_local_model(model_name: str, quantize: bool = True) -> LocalModel:
+    """Tải model cục bộ một lần và dùng lại cho các lần gọi sau."""
+    key = (model_name, quantize)
+    with _LOCAL_MODELS_LOCK:
+        if key not in _LOCAL_MODELS:
+            print(f"Đang tải model {model_name}{' (int8)' if quantize else ''}...")
+            _LOCAL_MODELS[key] = LocalModel(model_name, quantize)
+        return _LOCAL_MODELS[key]
+
+
+class TextGenerationServerLLM(LLM):
+    """
+    LLM gọi một server text-generation-inference (TGI) chạy cục bộ.
+
+    Ở chế độ `streaming`, token được đọc từ server ngay khi sinh ra và báo qua
+    callback `on_llm_new_token`, nên giao diện có thể hiển thị dần câu trả lời.
+    """
+
+    endpoint_url: str = "http://localhost:8080"
+    max_new_tokens: int = 512
+    temperature: float = 0.5
+    timeout: Optional[float] = 120
+    streaming: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "text-generation-server"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {'endpoint_url': self.endpoint_url, 'max_new_tokens': self.max_new_tokens,
+                'temperature': self.temperature}
+
+    def _client(self):
+        from huggingface_hub import InferenceClient
+        return InferenceClient(model=self.endpoint_url, timeout=self.timeout)
+
+    def _params(self, stop: Optional[List[str]]) -> dict:
+        params = {'max_new_tokens': self.max_new_tokens, 'stop_sequences': stop or []}
+        if self.temperature > 0:
+            params.update(do_sample=True, temperature=self.temperature)
+        return params
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None,
+              run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> str:
+        if self.streaming:
+            return ''.join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+        return self._client().text_generation(prompt, **self._params(stop))
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        for token in self._client().text_generation(prompt, stream=True, **self._params(stop)):
+            if stop and token in stop:
+                break
+            chunk = GenerationChunk(text=token)
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+class LocalTransformersLLM(LLM):
+    """
+    LLM chạy trong tiến trình bằng `transformers` trên CPU, không cần gọi mạng.
+
+    Model được tải một lần (lượng tử hóa int8 nếu được) và dùng chung. Nhiều
+    prompt gửi cùng lúc qua `generate` được sinh trong một batch. Với
+    `batch_size` > 1, prompt của các lần gọi đồng thời (nhiều người dùng) được
+    gom trong `batch_wait` giây thành một batch. Ở chế độ `streaming`, token
+    của một prompt được báo qua callback khi sinh ra (không gom lô).
+    """
+
+    model_name: str = "google/flan-t5-large"
+    quantize: bool = True
+    max_new_tokens: int = 512
+    temperature: float = 0.5
+    streaming: bool = False
+    batch_size: int = 1
+    batch_wait: float = 0.02
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-transformers"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {'model_name': self.model_name, 'quantize': self.quantize,
+                'max_new_tokens': self.max_new_tokens, 'temperature': self.temperature}
+
+    @property
+    def local_model(self) -> LocalModel:
+        return load_local_model(self.model_name, self.quantize)
+
+    @property
+    def batcher(self) -> MicroBatcher:
+        """Bộ gom lô dùng chung, gom prompt của nhiều người dùng thành một lần gọi model."""
+        key = (self.model_name, self.quantize, self.max_new_tokens, self.temperature, self.batch_size, self.batch_wait)
+        with _LOCAL_MODELS_LOCK:
+            if key not in _BATCHERS:
+                _BATCHERS[key] = MicroBatcher(
+                    lambda prompts: self.local_model.generate(prompts, self.max_new_tokens, self.temperature),
+                    max_batch_size=self.batch_size,
+                    max_wait=self.batch_wait
+                )
+            return _BATCHERS[key]
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None,
+              run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> str:
+        if self.streaming and run_manager:
+            text = ''.join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+        elif self.batch_size > 1:
+            text = self.batcher(prompt)
+        else:
+            text = self.local_model.generate([prompt], self.max_new_tokens, self.temperature)[0]
+        return _truncate_at_stop(text, stop)
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        from transformers import TextIteratorStreamer
+
+        local_model = self.local_model
+        streamer = TextIteratorStreamer(local_model.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+
+        def run():
+            try:
+                local_model.generate([prompt], self.max_new_tokens, self.temperature, streamer)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        for token in streamer:
+            if not token:
+                continue
+            chunk = GenerationChunk(text=token)
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        worker.join()
+        if errors:
+            raise errors[0]
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> LLMResult:
+        if len(prompts) == 1:
+            return super()._generate(prompts, stop, run_manager, **kwargs)
+        texts = self.local_model.generate(prompts, self.max_new_tokens, self.temperature)
+        return LLMResult(generations=[[Generation(text=_truncate_at_stop(text, stop))] for text in texts])
+
+
+def _truncate_at_stop(text: str, stop: Optional[List[str]]) -> str:
+    for sequence in stop or []:
+        position = text.find(sequence)
+        if position != -1:
+            text = text[:position]
+    return text
+
+
+def create_llm(backend: str = 'hub', repo_id: str = "google/flan-t5-large", api_key: Optional[str] = None,
+               endpoint_url: Optional[str] = None, temperature: float = 0.5, max_new_tokens: int = 512,
+               streaming: bool = False, tags: Optional[List[str]] = None, quantize: bool = True,
+               batch_size: int = 1, batch_wait: float = 0.02) -> LLM:
+    """
+    Khởi tạo LLM theo backend được cấu hình.
+
+    Args:
+        backend: 'hub' (HuggingFace Inference API), 'tgi' (server text-generation-inference cục bộ)
+            hoặc 'local' (transformers trong tiến trình, trên CPU)
+        repo_id: Model trên HuggingFace Hub (backend 'hub' và 'local')
+        api_key: HuggingFace API token (backend 'hub')
+        endpoint_url: Địa chỉ server TGI (backend 'tgi')
+        temperature: Nhiệt độ sinh văn bản
+        max_new_tokens: Số token tối đa của câu trả lời
+        streaming: Báo từng token qua callback khi backend hỗ trợ ('tgi' và 'local')
+        tags: Tag gắn vào các lần gọi LLM, dùng để lọc callback
+        quantize: Lượng tử hóa int8 trọng số model (backend 'local')
+        batch_size: Số prompt tối đa gom thành một lần gọi model (backend 'local', 1 để tắt)
+        batch_wait: Thời gian tối đa (giây) chờ gom thêm prompt (backend 'local')
+
+    Returns:
+        LLM: Đối tượng LLM của LangChain
+    """
+    if backend == 'tgi':
+        return TextGenerationServerLLM(
+            endpoint_url=endpoint_url or "http://localhost:8080",
+            temperature=temperature,
+            max_new_tokens=max_new_tokens,
+            streaming=streaming,
+            tags=tags
+        )
+    if backend == 'local':
+        return LocalTransformersLLM(
+            model_name=repo_id,
+            quantize=quantize,
+            temperature=temperature,
+            max_new_tokens=max_new_tokens,
+            streaming=streaming,
+            tags=tags,
+            batch_size=batch_size,
+            batch_wait=batch_wait
+        )
+    if backend == 'hub':
+        return HuggingFaceHub(
+            repo_id=repo_id,
+            task="text2text-generation",
+            model_kwargs={"temperature": temperature, "max_length": max_new_tokens},
+            huggingfacehub_api_token=api_key,
+            tags=tags
+        )
+    raise ValueError(f"Backend LLM không hợp lệ: {backend} (chọn một trong {', '.join(LLM_BACKENDS)})")
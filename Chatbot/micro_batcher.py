@@ -0,0 +1,92 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+
+class MicroBatcher:
+    """
+    Gom các yêu cầu đến gần nhau thành một lô để xử lý một lần.
+
+    Một thread nền chờ yêu cầu đầu tiên, sau đó gom thêm các yêu cầu đến
+    trong vòng `max_wait` giây (tối đa `max_batch_size` yêu cầu), gọi
+    `process_batch` với cả lô rồi trả kết quả về cho từng người gọi. Độ trễ
+    thêm vào mỗi yêu cầu không quá `max_wait`.
+    """
+
+    def __init__(self, process_batch: Callable[[List], List], max_batch_size: int = 8, max_wait: float = 0.02):
+        """
+        Args:
+            process_batch: Hàm nhận danh sách yêu cầu, trả về danh sách kết quả cùng thứ tự
+            max_batch_size: Số yêu cầu tối đa mỗi lô
+            max_wait: Thời gian tối đa (giây) chờ gom thêm yêu cầu sau yêu cầu đầu tiên
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, daemon=True)
+                self._thread.start()
+
+    def submit(self, item) -> Future:
+        """Gửi một yêu cầu, trả về Future chứa kết quả."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        """Gửi một yêu cầu và chờ kết quả."""
+        return self.submit(item).result(timeout)
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+            try:
+                results = list(self.process_batch([item for item, _ in batch]))
+                if len(results) != len(batch):
+                    # zip sẽ bỏ qua các yêu cầu thừa và người gọi chờ mãi
+                    raise RuntimeError(f"process_batch trả về {len(results)} kết quả cho lô {len(batch)} yêu cầu")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        """Thống kê số lô và kích thước lô trung bình."""
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'items': self.items,
+                'largest_batch': self.largest_batch,
+                'average_batch': self.items / self.batches if self.batches else 0.0
+            }
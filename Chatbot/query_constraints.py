@@ -0,0 +1,105 @@
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Tuple
+
+from title_index import normalize_title
+
+# Trạng thái phim trong dữ liệu crawl và các cách người dùng hay hỏi (đã bỏ dấu).
+# Chỉ dùng cụm từ chỉ trạng thái rõ ràng: bộ lọc trạng thái loại hẳn các phim còn lại
+STATUS_ONGOING = 'Đang tiến hành'
+STATUS_COMPLETED = 'Hoàn thành'
+_STATUS_PATTERNS = (
+    (STATUS_ONGOING, re.compile(r'\b(dang (chieu|tien hanh|phat song|ra|cap nhat)|chua (hoan thanh|ket thuc|xong)|ongoing)\b')),
+    (STATUS_COMPLETED, re.compile(r'\b(hoan thanh|da ket thuc|ket thuc roi|tron bo|completed)\b')),
+)
+
+# Tên gọi thường dùng -> các thể loại trong dữ liệu (một trong số đó)
+GENRE_ALIASES = {
+    'boylove': ('Shounen AI', 'Đam mỹ'),
+    'boy love': ('Shounen AI', 'Đam mỹ'),
+    'girllove': ('Shoujo AI',),
+    'girl love': ('Shoujo AI',),
+    'yuri': ('Shoujo AI',),
+    'hoat hinh trung quoc': ('CN Animation',),
+    'donghua': ('CN Animation',),
+}
+
+# Chỉ so sánh nhất rõ ràng ("rating cao nhất", "top 10 phim"); "rating cao không?" hỏi về một phim cụ thể
+_RATING_SORT = re.compile(
+    r'\b(rating|danh gia|diem|xep hang) (cao|tot) nhat\b|\b(hay nhat|cao diem nhat|noi tieng nhat)\b'
+    r'|\btop (\d{1,2} )?(phim|anime|bo)\b|\b(top|highest|best) rated\b'
+)
+_YEAR = re.compile(r'\b(?:(truoc|sau|tu) (?:nam )?)?((?:19|20)\d{2})\b')
+_YEAR_OPERATORS = {'truoc': '<', 'sau': '>', 'tu': '>=', None: '='}
+
+
+@dataclass
+class QueryConstraints:
+    """
+    Ràng buộc có cấu trúc trích từ câu hỏi.
+
+    `genres` là danh sách nhóm thể loại: phim phải thuộc ít nhất một thể loại
+    trong mỗi nhóm (giao các nhóm, hợp trong nhóm).
+    """
+    genres: List[Tuple[str, ...]] = field(default_factory=list)
+    status: Optional[str] = None
+    year: Optional[int] = None
+    year_op: str = '='
+    sort_by_rating: bool = False
+
+    @property
+    def has_filters(self) -> bool:
+        return bool(self.genres) or self.status is not None or self.year is not None
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.has_filters and not self.sort_by_rating
+
+
+def _contains_phrase(text: str, phrase: str) -> bool:
+    return re.search(rf'\b{re.escape(phrase)}\b', text) is not None
+
+
+def parse_constraints(question: str, genre_names: Iterable[str]) -> QueryConstraints:
+    """
+    Trích ràng buộc thể loại, trạng thái, năm phát hành và yêu cầu xếp theo
+    rating từ câu hỏi (không dùng LLM, so khớp trên văn bản đã bỏ dấu).
+
+    Ví dụ: "Có những phim boylove nào đang chiếu?" ->
+    genres=[('Shounen AI', 'Đam mỹ')], status='Đang tiến hành'.
+
+    Args:
+        question: Câu hỏi của người dùng
+        genre_names: Các thể loại có trong catalog
+
+    Returns:
+        QueryConstraints: Ràng buộc tìm được (rỗng nếu không có)
+    """
+    text = normalize_title(question)
+    constraints = QueryConstraints()
+
+    matched = set()
+    # Ưu tiên tên dài trước để "Shounen AI" không bị khớp thành "Shounen"
+    for genre in sorted(genre_names, key=len, reverse=True):
+        key = normalize_title(genre)
+        if key and key not in matched and _contains_phrase(text, key):
+            if any(key in other for other in matched):
+                continue
+            matched.add(key)
+            constraints.genres.append((genre,))
+    for alias, genres in GENRE_ALIASES.items():
+        if _contains_phrase(text, alias):
+            constraints.genres.append(genres)
+
+    for status, pattern in _STATUS_PATTERNS:
+        if pattern.search(text):
+            constraints.status = status
+            break
+
+    year_match = _YEAR.search(text)
+    if year_match:
+        constraints.year = int(year_match.group(2))
+        constraints.year_op = _YEAR_OPERATORS[year_match.group(1)]
+
+    constraints.sort_by_rating = bool(_RATING_SORT.search(text))
+    return constraints
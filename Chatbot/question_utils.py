@@ -0,0 +1,20 @@
+import re
+
+from embedding_cache import normalize_query
+
+# Các từ/cụm từ cho thấy câu hỏi phụ thuộc vào ngữ cảnh hội thoại trước đó
+_FOLLOW_UP_PATTERNS = re.compile(
+    r'\b(nó|chúng|họ|ấy|đó|này|kia|vậy|thế còn|còn phim|phim đó|phim này|phim kia|'
+    r'bộ đó|bộ này|tập đó|cái đó|cái này|trên|ở trên|vừa rồi|vừa nói|nữa|'
+    r'it|its|they|them|that one|this one)\b'
+)
+
+
+def is_follow_up(question: str) -> bool:
+    """
+    Đoán nhanh (không dùng LLM) câu hỏi có phụ thuộc vào lịch sử hội thoại không.
+
+    Ví dụ "Nó có bao nhiêu tập?" hoặc "Còn phim nào tương tự nữa?" là câu hỏi
+    nối tiếp; "Kể cho tôi về phim One Piece" là câu hỏi độc lập.
+    """
+    return bool(_FOLLOW_UP_PATTERNS.search(normalize_query(question)))
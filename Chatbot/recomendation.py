@@ -1,6 +1,7 @@
 import sys
 import io
 import pickle
+import hashlib
 
 # Cấu hình stdout để sử dụng UTF-8, giải quyết vấn đề UnicodeEncodeError trên Windows
 if sys.stdout.encoding != 'utf-8':
@@ -8,10 +9,10 @@ if sys.stdout.encoding != 'utf-8':
 
 import pandas as pd
 import mysql.connector
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
 import numpy as np
 
+from catalog import CatalogSnapshot, build_catalog_snapshot
+
 # Cấu hình kết nối MySQL (Giống với import_to_database.py)
 DB_CONFIG = {
     'host': 'localhost',
@@ -21,16 +22,15 @@ DB_CONFIG = {
 }
 TABLE_NAME = 'anime'
 
-# Biến toàn cục để lưu trữ TF-IDF matrix
-tfidf_matrix = None
-tfidf_vectorizer = None
+# Ảnh chụp catalog dựng từ DataFrame cho các lời gọi truyền DataFrame trực tiếp: (khóa nội dung, ảnh chụp)
+_catalog_cache = None
 
 def load_data_from_db():
     """Tải dữ liệu anime từ MySQL database."""
     try:
         conn = mysql.connector.connect(**DB_CONFIG)
         query = """
-        SELECT title, genres, description 
+        SELECT title, genres, description, rating_score, rating_count
         FROM anime
         """
         df = pd.read_sql(query, conn)
@@ -41,60 +41,73 @@ def load_data_from_db():
         print(f"Lỗi khi tải dữ liệu từ database: {str(e)}")
         return pd.DataFrame()
 
-def get_content_based_recommendations_tfidf(movie_title, df, top_n=5):
+def get_catalog_snapshot(catalog):
+    """
+    Trả về CatalogSnapshot tương ứng.
+
+    Nếu `catalog` đã là CatalogSnapshot thì dùng trực tiếp; nếu là DataFrame
+    thì ảnh chụp chỉ được xây dựng lại khi nội dung DataFrame (tên, mô tả,
+    thể loại, rating...) thay đổi.
+    """
+    global _catalog_cache
+    if isinstance(catalog, CatalogSnapshot):
+        return catalog
+    key = _dataframe_key(catalog)
+    if _catalog_cache is None or _catalog_cache[0] != key:
+        _catalog_cache = (key, build_catalog_snapshot(catalog))
+    return _catalog_cache[1]
+
+def _dataframe_key(df):
+    """Hash nội dung DataFrame (tên cột và mọi giá trị, không tính index)."""
+    h = hashlib.sha1('\0'.join(map(str, df.columns)).encode('utf-8'))
+    if not df.empty:
+        try:
+            h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        except TypeError:
+            # Cột chứa giá trị không hash được (vd. list thể loại)
+            h.update(df.to_csv(index=False).encode('utf-8'))
+    return h.hexdigest()
+
+def get_title_index(catalog):
+    """Trả về chỉ mục tên phim của catalog."""
+    return get_catalog_snapshot(catalog).title_index
+
+def get_content_based_recommendations_tfidf(movie_title, catalog, top_n=5):
     """
     Gợi ý phim dựa trên nội dung sử dụng TF-IDF.
     
     Args:
         movie_title (str): Tên phim cần gợi ý
-        df (DataFrame): DataFrame chứa dữ liệu phim
+        catalog (CatalogSnapshot | DataFrame): Catalog phim (nên truyền ảnh chụp dựng sẵn)
         top_n (int): Số lượng phim gợi ý
         
     Returns:
         list: Danh sách các phim được gợi ý
     """
-    global tfidf_matrix, tfidf_vectorizer
-    
-    if movie_title not in df['title'].values:
+    snapshot = get_catalog_snapshot(catalog)
+    if snapshot.empty:
         return []
+    # Ma trận TF-IDF và bảng hàng xóm đã được tính sẵn trong ảnh chụp
+    return snapshot.recommender.recommend(movie_title, top_n=top_n)
+
+def get_batch_content_based_recommendations(movie_titles, catalog, top_n=10):
+    """
+    Gợi ý phim dựa trên nhiều phim cùng lúc (ví dụ lịch sử xem của người dùng).
     
-    # Tạo corpus từ title, genres và description
-    df['content'] = df['title'] + ' ' + df['genres'].fillna('') + ' ' + df['description'].fillna('')
-    
-    # Khởi tạo TF-IDF vectorizer nếu chưa có
-    if tfidf_vectorizer is None:
-        tfidf_vectorizer = TfidfVectorizer(
-            stop_words='english',
-            max_features=5000,
-            ngram_range=(1, 2)
-        )
-        tfidf_matrix = tfidf_vectorizer.fit_transform(df['content'])
-    
-    # Lấy index của phim
-    movie_idx = df[df['title'] == movie_title].index[0]
-    
-    # Tính toán độ tương đồng cosine
-    movie_vector = tfidf_matrix[movie_idx]
-    similarities = cosine_similarity(movie_vector, tfidf_matrix).flatten()
-    
-    # Lấy các phim tương tự nhất (bỏ qua chính nó)
-    similar_indices = similarities.argsort()[::-1][1:top_n+1]
-    
-    # Trả về danh sách các phim được gợi ý
-    recommendations = []
-    for idx in similar_indices:
-        movie = df.iloc[idx]
-        recommendations.append({
-            'title': movie['title'],
-            'genres': movie['genres'],
-            'description': movie['description'],
-            'similarity_score': float(similarities[idx])
-        })
-    
-    return recommendations
+    Args:
+        movie_titles (list): Danh sách tên phim đã xem
+        catalog (CatalogSnapshot | DataFrame): Catalog phim
+        top_n (int): Số lượng phim gợi ý
+        
+    Returns:
+        dict: Tên phim khớp, tên phim không tìm thấy và danh sách gợi ý đã gộp
+    """
+    snapshot = get_catalog_snapshot(catalog)
+    if snapshot.empty:
+        return {'matched_titles': [], 'not_found': list(movie_titles), 'recommendations': []}
+    return snapshot.recommender.recommend_for_history(movie_titles, top_n=top_n)
 
-# Hàm get_simplified_collaborative_recommendations giữ nguyên như trước
-def get_simplified_collaborative_recommendations(input_movie_title, df, top_n=10):
+def get_simplified_collaborative_recommendations(input_movie_title, catalog, top_n=10):
     """
     Gợi ý phim dựa trên một phương pháp "Collaborative Filtering" đơn giản hóa.
     Phương pháp này gợi ý các phim phổ biến khác (rating_score cao)
@@ -104,35 +117,31 @@ def get_simplified_collaborative_recommendations(input_movie_title, df, top_n=10
     tương tác của từng người dùng (user-item ratings).
     Một hệ thống CF đầy đủ cần ma trận user-item (user_id, movie_id, rating).
     """
-    if df.empty or input_movie_title not in df['title'].values:
+    snapshot = get_catalog_snapshot(catalog)
+    movie_idx = None if snapshot.empty else snapshot.title_index.lookup(input_movie_title)
+    if movie_idx is None:
         print(f"Không tìm thấy phim '{input_movie_title}' trong database hoặc database rỗng cho simplified CF.")
         return []
 
-    input_movie_details = df[df['title'] == input_movie_title].iloc[0]
-    input_genres_str = input_movie_details['genres']
-    input_genres = set(input_genres_str.split(', ')) if pd.notna(input_genres_str) and input_genres_str else set()
+    input_movie_title = snapshot.titles[movie_idx]
+    input_genres = snapshot.genre_matrix[movie_idx]
     
-    if not input_genres:
+    if not input_genres.any():
         print(f"Phim '{input_movie_title}' không có thông tin thể loại để gợi ý.")
         return []
 
-    recommended_movies = []
-    for index, row in df.iterrows():
-        if row['title'] == input_movie_title:
-            continue
-        
-        current_movie_genres_str = row['genres']
-        current_movie_genres = set(current_movie_genres_str.split(', ')) if pd.notna(current_movie_genres_str) and current_movie_genres_str else set()
-        
-        if input_genres.intersection(current_movie_genres):
-            rating_score = row['rating_score']
-            # rating_count đã được thêm vào df từ load_data_from_db
-            rating_count = row['rating_count'] if 'rating_count' in df.columns and pd.notna(row['rating_count']) else 0
-            recommended_movies.append((rating_score, rating_count, row['title']))
-    
-    recommended_movies.sort(key=lambda x: (x[0] is None, -float('inf') if x[0] is None else -x[0], x[1] is None, -float('inf') if x[1] is None else -x[1]))
+    # Các phim có ít nhất một thể loại chung với phim đầu vào
+    candidate_mask = snapshot.genre_matrix[:, input_genres].any(axis=1)
+    candidate_mask[movie_idx] = False
+    candidates = np.flatnonzero(candidate_mask)
+
+    # Sắp xếp theo rating_score giảm dần (thiếu rating xếp cuối), rồi rating_count giảm dần
+    rating_scores = snapshot.rating_scores[candidates]
+    rating_counts = np.nan_to_num(snapshot.rating_counts[candidates], nan=0.0)
+    missing_score = np.isnan(rating_scores)
+    order = np.lexsort((-rating_counts, -np.nan_to_num(rating_scores, nan=0.0), missing_score))
 
-    return [movie[2] for movie in recommended_movies[:top_n]]
+    return [snapshot.titles[idx] for idx in candidates[order[:top_n]]]
 
 
 if __name__ == "__main__":
@@ -140,10 +149,11 @@ if __name__ == "__main__":
 
     if not anime_df.empty:
         target_anime_title = "One Piece" 
+        anime_catalog = build_catalog_snapshot(anime_df)
 
-        if target_anime_title in anime_df['title'].values:
+        if target_anime_title in anime_catalog.title_index:
             print(f"\n--- Gợi ý Content-Based (TF-IDF) cho '{target_anime_title}' ---")
-            cb_tfidf_recommendations = get_content_based_recommendations_tfidf(target_anime_title, anime_df.copy())
+            cb_tfidf_recommendations = get_content_based_recommendations_tfidf(target_anime_title, anime_catalog)
             if cb_tfidf_recommendations:
                 for i, rec in enumerate(cb_tfidf_recommendations):
                     print(f"{i+1}. {rec['title']} (Độ tương đồng: {rec['similarity_score']:.2f})")
@@ -151,7 +161,7 @@ if __name__ == "__main__":
                 print("Không có gợi ý nào từ Content-Based (TF-IDF).")
 
             print(f"\n--- Gợi ý Collaborative Filtering (Đơn giản hóa) cho '{target_anime_title}' ---")
-            scf_recommendations = get_simplified_collaborative_recommendations(target_anime_title, anime_df.copy())
+            scf_recommendations = get_simplified_collaborative_recommendations(target_anime_title, anime_catalog)
             if scf_recommendations:
                 for i, rec_title in enumerate(scf_recommendations):
                     print(f"{i+1}. {rec_title}")
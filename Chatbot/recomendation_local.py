@@ -1,12 +1,13 @@
 import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import os
 import sys
 import io
 import json
 
+from tfidf_recommender import TfidfRecommender, load_stopwords
+from genre_index import GenreIndex, parse_genre_query
+
 # Cấu hình encoding cho Windows
 if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
@@ -48,73 +49,29 @@ def load_data():
         return pd.DataFrame()
 
 def load_vietnamese_stopwords(filepath="data/stopwords-vi.txt"):
-    with open(filepath, "r", encoding="utf-8") as f:
-        stopwords = [line.strip() for line in f if line.strip()]
-    return stopwords
+    return load_stopwords(filepath)
 
-def get_content_based_recommendations_tfidf(movie_title, df, top_n):
-    """Gợi ý phim dựa trên nội dung sử dụng TF-IDF."""
-    if movie_title not in df['title'].values:
-        return []
-    
-    # Tạo corpus từ title, genres và description
-    df['content'] = df['title'] + ' ' + df['genres'].fillna('') + ' ' + df['description'].fillna('')
-    vietnamese_stopwords = load_vietnamese_stopwords()
-    tfidf_vectorizer = TfidfVectorizer(
-        stop_words=vietnamese_stopwords,
-        max_features=5000,
-        ngram_range=(1, 2)
-    )
-    tfidf_matrix = tfidf_vectorizer.fit_transform(df['content'])
-    
-    
-    movie_idx = df[df['title'] == movie_title].index[0]
-    
-    # độ tương đồng cosine
-    movie_vector = tfidf_matrix[movie_idx]
-    similarities = cosine_similarity(movie_vector, tfidf_matrix).flatten()
-    
-    # Lấ top n
-    similar_indices = similarities.argsort()[::-1][1:top_n+1]
-    
-    recommendations = []
-    for idx in similar_indices:
-        movie = df.iloc[idx]
-        recommendations.append({
-            'title': movie['title'],
-            'genres': movie['genres'],
-            'description': movie['description'],
-            'similarity_score': float(similarities[idx])
-        })
-    
-    return recommendations
+def get_content_based_recommendations_tfidf(movie_title, df, top_n, recommender=None):
+    """Gợi ý phim dựa trên nội dung sử dụng TF-IDF.
 
-def get_genre_based_recommendations(genre, df, top_n):
-    """Gợi ý phim dựa trên thể loại."""
-    if df.empty:
-        return []
-    
-    # Filtering 
-    genre_movies = df[df['genres'].str.contains(genre, case=False, na=False)]
-    
-    if genre_movies.empty:
-        return []
-    
-    # Sắp xếp theo rating_score/rating_count
-    if 'rating_score' in genre_movies.columns:
-        genre_movies = genre_movies.sort_values('rating_score', ascending=False)
-    
-    # Lấy top N phim
-    recommendations = []
-    for _, movie in genre_movies.head(top_n).iterrows():
-        recommendations.append({
-            'title': movie['title'],
-            'genres': movie['genres'],
-            'description': movie['description'],
-            'rating_score': movie.get('rating_score', 'N/A')
-        })
-    
-    return recommendations
+    Nên truyền `recommender` đã được xây dựng sẵn để tránh fit lại TF-IDF mỗi lần gọi.
+    """
+    if recommender is None:
+        recommender = TfidfRecommender(df)
+    return recommender.recommend(movie_title, top_n=top_n)
+
+def get_genre_based_recommendations(genre, df, top_n, genre_index=None):
+    """Gợi ý phim dựa trên thể loại.
+
+    `genre` có thể gồm nhiều thể loại: "a, b" (có ít nhất một) hoặc "a + b" (có tất cả).
+    Nên truyền `genre_index` đã được xây dựng sẵn để không phải quét lại DataFrame.
+    """
+    if genre_index is None:
+        if df.empty:
+            return []
+        genre_index = GenreIndex(df)
+    genres, mode = parse_genre_query(genre)
+    return genre_index.query(genres, top_n=top_n, mode=mode)
 
 def main():
     df = load_data()
@@ -122,6 +79,10 @@ def main():
         print("Không thể tải dữ liệu. Vui lòng kiểm tra file JSON.")
         return
 
+    # Fit TF-IDF một lần (hoặc tải từ cache) cho toàn bộ phiên làm việc
+    recommender = TfidfRecommender(df, stop_words=load_vietnamese_stopwords())
+    genre_index = GenreIndex(df)
+
     while True:
         print("\n=== HỆ THỐNG GỢI Ý PHIM ===")
         print("1. Gợi ý phim dựa trên phim yêu thích")
@@ -136,7 +97,10 @@ def main():
                 top_n = int(input("Nhập số lượng phim muốn đề xuất (mặc định 5): ") or 5)
             except ValueError:
                 top_n = 5
-            recommendations = get_content_based_recommendations_tfidf(movie_title, df, top_n=top_n)
+            matched_title = recommender.title_index.resolve(movie_title)
+            if matched_title and matched_title != movie_title:
+                print(f"Đang gợi ý cho phim: {matched_title}")
+            recommendations = get_content_based_recommendations_tfidf(movie_title, df, top_n=top_n, recommender=recommender)
             
             if recommendations:
                 print("\nCác phim được gợi ý:")
@@ -150,17 +114,14 @@ def main():
         
         elif choice == '2':
             print("\nCác thể loại phim phổ biến:")
-            genres = set()
-            for genre_list in df['genres'].dropna():
-                genres.update(genre_list.split(', '))
-            print(', '.join(sorted(genres)))
+            print(', '.join(genre_index.genre_names))
             
-            genre = input("\nNhập thể loại phim yêu thích: ")
+            genre = input("\nNhập thể loại phim yêu thích (nhiều thể loại: 'a, b' = một trong, 'a + b' = tất cả): ")
             try:
                 top_n = int(input("Nhập số lượng phim muốn đề xuất (mặc định 10): ") or 10)
             except ValueError:
                 top_n = 10
-            recommendations = get_genre_based_recommendations(genre, df, top_n=top_n)
+            recommendations = get_genre_based_recommendations(genre, df, top_n=top_n, genre_index=genre_index)
             
             if recommendations:
                 print("\nCác phim được gợi ý:")
@@ -0,0 +1,91 @@
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Cache trong bộ nhớ có giới hạn kích thước (LRU) và thời gian sống (TTL).
+
+    An toàn khi dùng từ nhiều thread. Đếm số lần hit/miss để theo dõi hiệu quả.
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        """
+        Args:
+            max_size (int): Số phần tử tối đa, phần tử ít dùng nhất bị loại trước
+            ttl (float | None): Thời gian sống (giây) của mỗi phần tử, None để không hết hạn
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Lấy giá trị theo khóa, trả về `default` nếu không có hoặc đã hết hạn."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Lưu giá trị, loại bỏ phần tử ít dùng nhất nếu vượt quá kích thước."""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Trả về giá trị trong cache, hoặc gọi `compute()` rồi lưu lại nếu chưa có."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def items(self):
+        """Danh sách (khóa, giá trị) còn hạn, theo thứ tự từ ít dùng đến dùng gần nhất."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value) for key, (value, expires_at) in self._data.items()
+                if expires_at is None or expires_at > now
+            ]
+
+    def clear(self):
+        """Xóa toàn bộ cache (bộ đếm hit/miss được giữ nguyên)."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Thống kê kích thước và tỉ lệ hit của cache."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0
+            }
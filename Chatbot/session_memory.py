@@ -0,0 +1,123 @@
+import re
+import threading
+from collections import deque
+from typing import List, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from result_cache import LRUCache
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _shorten(text: str, max_chars: int) -> str:
+    text = _WHITESPACE.sub(' ', text).strip()
+    return text if len(text) <= max_chars else text[:max_chars - 1].rstrip() + '…'
+
+
+def summarize_turn(question: str, answer: str, max_chars: int = 200) -> str:
+    """
+    Tóm tắt một lượt hội thoại cũ (không dùng LLM): câu hỏi và câu đầu tiên của câu trả lời.
+    """
+    first_sentence = _SENTENCE_END.split(_WHITESPACE.sub(' ', answer).strip(), maxsplit=1)[0]
+    half = max_chars // 2
+    return f"Hỏi: {_shorten(question, half)} -> {_shorten(first_sentence, half)}"
+
+
+class SessionMemory:
+    """
+    Bộ nhớ hội thoại của một phiên, có giới hạn kích thước.
+
+    Giữ nguyên văn `max_turns` lượt gần nhất (và tổng độ dài không quá
+    `max_chars` ký tự); các lượt cũ hơn được rút gọn thành một dòng tóm tắt,
+    chỉ giữ `max_summary_turns` dòng gần nhất. Nhờ vậy prompt không dài ra
+    theo số lượt hội thoại.
+    """
+
+    def __init__(self, max_turns: int = 4, max_chars: int = 2000, max_summary_turns: int = 8):
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.turns = deque()
+        self.summary = deque(maxlen=max_summary_turns)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.turns)
+
+    def add_turn(self, question: str, answer: str):
+        """Thêm một lượt hỏi-đáp, đẩy các lượt cũ vượt giới hạn vào phần tóm tắt."""
+        with self._lock:
+            self.turns.append((question, answer))
+            while self.turns and (
+                len(self.turns) > self.max_turns
+                or sum(len(q) + len(a) for q, a in self.turns) > self.max_chars
+            ):
+                self.summary.append(summarize_turn(*self.turns.popleft()))
+
+    def messages(self) -> List:
+        """Lịch sử hội thoại dạng message, dùng làm `chat_history` cho chain."""
+        with self._lock:
+            history = []
+            if self.summary:
+                history.append(SystemMessage(content="Tóm tắt hội thoại trước: " + " | ".join(self.summary)))
+            for question, answer in self.turns:
+                history.append(HumanMessage(content=question))
+                history.append(AIMessage(content=answer))
+            return history
+
+    def clear(self):
+        with self._lock:
+            self.turns.clear()
+            self.summary.clear()
+
+
+class SessionMemoryStore:
+    """
+    Quản lý bộ nhớ hội thoại theo phiên (session Gradio hoặc user ID).
+
+    Mỗi phiên có một SessionMemory riêng. Phiên không hoạt động quá
+    `idle_ttl` giây bị loại, và chỉ giữ tối đa `max_sessions` phiên gần nhất,
+    nên bộ nhớ không tăng theo số người dùng.
+    """
+
+    def __init__(self, max_sessions: int = 1000, idle_ttl: Optional[float] = 1800,
+                 max_turns: int = 4, max_chars: int = 2000, max_summary_turns: int = 8):
+        """
+        Args:
+            max_sessions: Số phiên tối đa giữ trong bộ nhớ
+            idle_ttl: Số giây không hoạt động trước khi phiên bị loại, None để không hết hạn
+            max_turns: Số lượt gần nhất giữ nguyên văn trong mỗi phiên
+            max_chars: Tổng số ký tự tối đa của các lượt giữ nguyên văn
+            max_summary_turns: Số dòng tóm tắt lượt cũ tối đa
+        """
+        self.sessions = LRUCache(max_size=max_sessions, ttl=idle_ttl)
+        self.memory_kwargs = {
+            'max_turns': max_turns,
+            'max_chars': max_chars,
+            'max_summary_turns': max_summary_turns
+        }
+
+    def get(self, session_id: str) -> SessionMemory:
+        """Lấy bộ nhớ của phiên, tạo mới nếu chưa có hoặc đã hết hạn."""
+        memory = self.sessions.get(session_id)
+        if memory is None:
+            memory = SessionMemory(**self.memory_kwargs)
+        # Ghi lại mỗi lần truy cập để gia hạn thời gian sống của phiên
+        self.sessions.set(session_id, memory)
+        return memory
+
+    def history(self, session_id: str) -> List:
+        """Lịch sử hội thoại (đã giới hạn) của phiên."""
+        return self.get(session_id).messages()
+
+    def add_turn(self, session_id: str, question: str, answer: str):
+        """Lưu một lượt hỏi-đáp vào bộ nhớ của phiên."""
+        self.get(session_id).add_turn(question, answer)
+
+    def clear(self, session_id: str):
+        """Xóa lịch sử của một phiên."""
+        self.get(session_id).clear()
+
+    def stats(self) -> dict:
+        return self.sessions.stats()
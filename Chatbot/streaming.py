@@ -0,0 +1,54 @@
+import queue
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+_DONE = object()
+
+
+class TokenQueueHandler(BaseCallbackHandler):
+    """Callback đẩy từng token LLM sinh ra vào một hàng đợi (chỉ các lần gọi có `tag` nếu được chỉ định)."""
+
+    def __init__(self, tag: Optional[str] = None):
+        self.tag = tag
+        self.queue = queue.Queue()
+
+    def on_llm_new_token(self, token: str, *, tags=None, **kwargs: Any) -> None:
+        if self.tag is None or (tags and self.tag in tags):
+            self.queue.put(token)
+
+
+class StreamingRun:
+    """
+    Chạy một chain ở thread nền và trả về token của câu trả lời khi chúng được sinh ra.
+
+    Duyệt đối tượng để nhận từng token; sau khi duyệt xong, `result` là kết
+    quả đầy đủ của chain (lỗi trong chain được ném lại ở cuối vòng lặp).
+    Với backend không hỗ trợ streaming sẽ không có token nào, chỉ có `result`.
+    """
+
+    def __init__(self, chain, inputs: Dict[str, Any], tag: Optional[str] = None):
+        self.handler = TokenQueueHandler(tag)
+        self.result = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run, args=(chain, inputs), daemon=True)
+        self._thread.start()
+
+    def _run(self, chain, inputs):
+        try:
+            self.result = chain.invoke(inputs, config={"callbacks": [self.handler]})
+        except Exception as e:
+            self.error = e
+        finally:
+            self.handler.queue.put(_DONE)
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            token = self.handler.queue.get()
+            if token is _DONE:
+                break
+            yield token
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
@@ -2,6 +2,10 @@ import sys
 import io
 import pickle
 import os
+import asyncio
+import secrets
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 # Cấu hình stdout để sử dụng UTF-8
@@ -13,35 +17,132 @@ if hasattr(sys.stdout, 'encoding') and sys.stdout.encoding != 'utf-8':
     except Exception as e:
         print(f"Warning: Could not reconfigure stdout/stderr to UTF-8: {e}")
 
-from fastapi import FastAPI, HTTPException
-from typing import Optional, Dict, List
+from fastapi import FastAPI, HTTPException, Header
+from pydantic import BaseModel
+from typing import Optional, Dict, List, Any
 import uvicorn
-import pandas as pd
 
 # Import các hàm từ recomendation.py
 from recomendation import (
     load_data_from_db,
     get_content_based_recommendations_tfidf,
+    get_batch_content_based_recommendations,
     get_simplified_collaborative_recommendations
 )
+from catalog import CatalogSnapshot, build_catalog_snapshot
+from result_cache import LRUCache
+
+# Cache kết quả gợi ý, khóa (tên phim, phương pháp, top_n, phiên bản catalog)
+recommendation_cache = LRUCache(
+    max_size=int(os.getenv('RECOMMENDATION_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('RECOMMENDATION_CACHE_TTL', 0)) or None
+)
+
+# Thread pool cho phần tính toán nặng (pandas/NumPy/scikit-learn) để không chặn event loop
+MAX_WORKERS = int(os.getenv('RECOMMENDATION_WORKERS', os.cpu_count() or 4))
+recommendation_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='recommendation')
+# Giới hạn số request gợi ý xử lý đồng thời; request vượt quá sẽ chờ tối đa REQUEST_QUEUE_TIMEOUT giây
+MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', MAX_WORKERS * 4))
+REQUEST_QUEUE_TIMEOUT = float(os.getenv('REQUEST_QUEUE_TIMEOUT', 10))
+# Số phim tối đa trong một yêu cầu gợi ý hàng loạt (ma trận tương đồng và khóa cache tăng theo số phim)
+MAX_BATCH_TITLES = int(os.getenv('MAX_BATCH_TITLES', 100))
+request_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+async def run_in_pool(fn, *args, **kwargs):
+    """Chạy một hàm đồng bộ trong thread pool và chờ kết quả."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(recommendation_executor, functools.partial(fn, *args, **kwargs))
+
+async def cached_in_pool(key, fn, *args, **kwargs):
+    """Trả kết quả từ cache nếu có, nếu không thì tính trong thread pool rồi lưu vào cache."""
+    result = recommendation_cache.get(key)
+    if result is None:
+        result = await run_in_pool(fn, *args, **kwargs)
+        recommendation_cache.set(key, result)
+    return result
+
+@asynccontextmanager
+async def request_slot():
+    """Giữ một chỗ trong giới hạn request đồng thời, trả 503 nếu chờ quá lâu."""
+    try:
+        await asyncio.wait_for(request_semaphore.acquire(), timeout=REQUEST_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Máy chủ đang quá tải. Vui lòng thử lại sau.")
+    try:
+        yield
+    finally:
+        request_semaphore.release()
+
+def set_catalog(catalog):
+    """Thay catalog toàn cục và xóa cache kết quả của catalog cũ."""
+    global anime_catalog_global
+    anime_catalog_global = catalog
+    recommendation_cache.clear()
+
+# Thread riêng cho việc nạp lại catalog, không chiếm worker của request gợi ý
+reload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='catalog-reload')
+reload_lock = asyncio.Lock()
+# Chu kỳ (giây) tự động nạp lại catalog, 0 để tắt
+CATALOG_RELOAD_INTERVAL = float(os.getenv('CATALOG_RELOAD_INTERVAL', 0))
+# Token bảo vệ endpoint quản trị; để trống thì endpoint quản trị bị tắt
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+async def reload_catalog():
+    """
+    Tải lại catalog từ database và dựng ảnh chụp mới ngoài luồng xử lý request.
+
+    Ảnh chụp mới chỉ được gán vào biến toàn cục khi đã dựng xong hoàn toàn, nên
+    request đang chạy tiếp tục dùng ảnh chụp cũ và không bao giờ thấy trạng thái dở dang.
+
+    Returns:
+        bool: True nếu catalog đã được thay bằng phiên bản mới
+    """
+    async with reload_lock:
+        loop = asyncio.get_running_loop()
+        anime_df = await loop.run_in_executor(reload_executor, load_data_from_db)
+        if anime_df.empty:
+            print("CẢNH BÁO: Không tải được dữ liệu anime từ database, giữ nguyên catalog hiện tại.")
+            return False
+        # Tiền xử lý catalog: nội dung, thể loại, rating, TF-IDF, chỉ mục tên
+        catalog = await loop.run_in_executor(reload_executor, build_catalog_snapshot, anime_df)
+        if anime_catalog_global is not None and anime_catalog_global.version == catalog.version:
+            print("Catalog không thay đổi, bỏ qua việc thay thế.")
+            return False
+        set_catalog(catalog)
+        print(f"Đã tải thành công {len(catalog)} anime vào catalog toàn cục.")
+        return True
+
+async def periodic_reload(interval):
+    """Tác vụ nền nạp lại catalog theo chu kỳ."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await reload_catalog()
+        except Exception as e:
+            print(f"Lỗi khi nạp lại catalog định kỳ: {e}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan event handler cho FastAPI."""
     # Startup
-    global anime_df_global
     print("FastAPI application startup...")
     
     print("Đang tải dữ liệu anime từ database...")
-    anime_df_global = load_data_from_db()
-    if anime_df_global.empty:
+    await reload_catalog()
+    if anime_catalog_global is None:
         print("CẢNH BÁO: Không tải được dữ liệu anime từ database. API có thể không hoạt động đúng.")
-    else:
-        print(f"Đã tải thành công {len(anime_df_global)} anime vào DataFrame toàn cục.")
+
+    reload_task = None
+    if CATALOG_RELOAD_INTERVAL > 0:
+        reload_task = asyncio.create_task(periodic_reload(CATALOG_RELOAD_INTERVAL))
     
     yield
     # Shutdown
     print("FastAPI application shutdown...")
+    if reload_task:
+        reload_task.cancel()
+    recommendation_executor.shutdown(wait=False)
+    reload_executor.shutdown(wait=False)
 
 app = FastAPI(
     title="Anime Recommendation API",
@@ -50,11 +151,11 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# Biến toàn cục để lưu trữ DataFrame
-anime_df_global: pd.DataFrame = pd.DataFrame()
+# Ảnh chụp catalog chỉ đọc, dùng chung cho mọi request
+anime_catalog_global: Optional[CatalogSnapshot] = None
 
 @app.get("/recommendations/", 
-         response_model=Dict[str, List[Dict[str, str]]],
+         response_model=Dict[str, List[Any]],
          summary="Nhận gợi ý Anime",
          description="Cung cấp tên một anime và nhận danh sách gợi ý dựa trên Content-Based (TF-IDF) và Collaborative Filtering (đơn giản hóa)."
 )
@@ -63,27 +164,43 @@ async def get_recommendations(movie_title: str):
     Endpoint để nhận gợi ý phim.
     - **movie_title**: Tên của bộ phim bạn muốn nhận gợi ý (bắt buộc).
     """
-    if anime_df_global.empty:
+    catalog = anime_catalog_global
+    if catalog is None or catalog.empty:
         raise HTTPException(status_code=503, detail="Dữ liệu anime chưa sẵn sàng hoặc không tải được. Vui lòng thử lại sau.")
 
-    if movie_title not in anime_df_global['title'].values:
+    # Tra cứu qua chỉ mục tên (không phân biệt hoa thường, dấu, chấp nhận gõ sai nhẹ)
+    matched_title = catalog.title_index.resolve(movie_title)
+    if matched_title is None:
         raise HTTPException(status_code=404, detail=f"Phim '{movie_title}' không được tìm thấy trong cơ sở dữ liệu.")
+    movie_title = matched_title
 
     print(f"Nhận yêu cầu gợi ý cho: {movie_title}")
 
-    # Lấy gợi ý Content-Based (TF-IDF)
+    # Chạy song song Content-Based (TF-IDF) và Collaborative Filtering (Đơn giản hóa) trong thread pool
+    async with request_slot():
+        cb_result, cf_result = await asyncio.gather(
+            cached_in_pool(
+                (movie_title, 'content_based_tfidf', 5, catalog.version),
+                get_content_based_recommendations_tfidf, movie_title, catalog, top_n=5
+            ),
+            cached_in_pool(
+                (movie_title, 'collaborative_simplified', 5, catalog.version),
+                get_simplified_collaborative_recommendations, movie_title, catalog, top_n=5
+            ),
+            return_exceptions=True
+        )
+
     cb_recs = []
-    try:
-        cb_recs = get_content_based_recommendations_tfidf(movie_title, anime_df_global.copy(), top_n=5)
-    except Exception as e:
-        print(f"Lỗi khi lấy gợi ý Content-Based (TF-IDF) cho '{movie_title}': {e}")
+    if isinstance(cb_result, Exception):
+        print(f"Lỗi khi lấy gợi ý Content-Based (TF-IDF) cho '{movie_title}': {cb_result}")
+    else:
+        cb_recs = cb_result
 
-    # Lấy gợi ý Collaborative Filtering (Đơn giản hóa)
     cf_recs = []
-    try:
-        cf_recs = get_simplified_collaborative_recommendations(movie_title, anime_df_global.copy(), top_n=5)
-    except Exception as e:
-        print(f"Lỗi khi lấy gợi ý Collaborative Filtering (Đơn giản hóa) cho '{movie_title}': {e}")
+    if isinstance(cf_result, Exception):
+        print(f"Lỗi khi lấy gợi ý Collaborative Filtering (Đơn giản hóa) cho '{movie_title}': {cf_result}")
+    else:
+        cf_recs = cf_result
 
     if not cb_recs and not cf_recs:
         print(f"Không tìm thấy gợi ý nào cho '{movie_title}' từ cả hai phương pháp.")
@@ -93,6 +210,68 @@ async def get_recommendations(movie_title: str):
         "collaborative_simplified": cf_recs
     }
 
+class BatchRecommendationRequest(BaseModel):
+    movie_titles: List[str]
+    top_n: int = 10
+
+@app.post("/recommendations/batch",
+          summary="Nhận gợi ý Anime cho nhiều phim",
+          description="Cung cấp danh sách anime đã xem và nhận một danh sách gợi ý Content-Based (TF-IDF) đã gộp, không trùng lặp."
+)
+async def get_batch_recommendations(request: BatchRecommendationRequest):
+    """
+    Endpoint để nhận gợi ý cho nhiều phim trong một lần gọi.
+    - **movie_titles**: Danh sách tên phim đã xem (bắt buộc, tối đa MAX_BATCH_TITLES phim).
+    - **top_n**: Số lượng phim gợi ý (mặc định 10).
+    """
+    catalog = anime_catalog_global
+    if catalog is None or catalog.empty:
+        raise HTTPException(status_code=503, detail="Dữ liệu anime chưa sẵn sàng hoặc không tải được. Vui lòng thử lại sau.")
+
+    if not request.movie_titles:
+        raise HTTPException(status_code=400, detail="Danh sách phim không được để trống.")
+    if len(request.movie_titles) > MAX_BATCH_TITLES:
+        raise HTTPException(status_code=400, detail=f"Danh sách phim tối đa {MAX_BATCH_TITLES} phim.")
+    if request.top_n <= 0:
+        raise HTTPException(status_code=400, detail="top_n phải lớn hơn 0.")
+
+    print(f"Nhận yêu cầu gợi ý cho {len(request.movie_titles)} phim")
+    async with request_slot():
+        result = await cached_in_pool(
+            (tuple(request.movie_titles), 'batch_content_based_tfidf', request.top_n, catalog.version),
+            get_batch_content_based_recommendations, request.movie_titles, catalog, top_n=request.top_n
+        )
+    if not result['matched_titles']:
+        raise HTTPException(status_code=404, detail="Không có phim nào trong danh sách được tìm thấy trong cơ sở dữ liệu.")
+
+    return result
+
+@app.post("/admin/reload", summary="Nạp lại catalog anime")
+async def admin_reload(x_admin_token: Optional[str] = Header(default=None)):
+    """Nạp lại catalog từ database mà không cần khởi động lại máy chủ."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Token quản trị không hợp lệ.")
+    try:
+        reloaded = await reload_catalog()
+    except Exception as e:
+        print(f"Lỗi khi nạp lại catalog: {e}")
+        raise HTTPException(status_code=500, detail="Lỗi khi nạp lại catalog.")
+    catalog = anime_catalog_global
+    return {
+        "reloaded": reloaded,
+        "catalog_version": catalog.version if catalog else None,
+        "movies": len(catalog) if catalog else 0
+    }
+
+@app.get("/cache/stats", summary="Thống kê cache gợi ý")
+async def get_cache_stats():
+    """Trả về kích thước, số lần hit/miss và tỉ lệ hit của cache kết quả gợi ý."""
+    stats = recommendation_cache.stats()
+    stats['catalog_version'] = anime_catalog_global.version if anime_catalog_global else None
+    return stats
+
 @app.get("/")
 async def read_root():
     return {"message": "Chào mừng đến với API Gợi Ý Anime! Truy cập /docs để xem tài liệu API."}
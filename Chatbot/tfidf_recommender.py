@@ -0,0 +1,328 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from title_index import TitleIndex
+
+# Thư mục lưu ma trận TF-IDF đã tính sẵn
+DEFAULT_CACHE_DIR = os.path.join('data', 'tfidf_cache')
+DEFAULT_STOPWORDS_PATH = os.path.join('data', 'stopwords-vi.txt')
+
+
+def load_stopwords(filepath=DEFAULT_STOPWORDS_PATH):
+    """Đọc danh sách stopwords từ file (mỗi dòng một từ)."""
+    with open(filepath, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def build_content(df):
+    """Tạo corpus từ title, genres và description."""
+    return (
+        df['title'].fillna('') + ' ' + df['genres'].fillna('') + ' ' + df['description'].fillna('')
+    ).tolist()
+
+
+def top_k_indices(scores, k):
+    """
+    Lấy chỉ số của k phần tử có điểm cao nhất, sắp xếp giảm dần.
+
+    Dùng argpartition (O(n)) rồi chỉ sắp xếp k phần tử được chọn thay vì
+    argsort toàn bộ catalog.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class NeighborTable:
+    """
+    Bảng top-K hàng xóm gần nhất của mọi phim, tính sẵn một lần.
+
+    `indices[i]` và `scores[i]` là chỉ số và độ tương đồng của K phim giống
+    phim i nhất (đã sắp xếp giảm dần, không gồm chính nó), lưu dưới dạng
+    int32/float32 để tra cứu "phim tương tự X" chỉ tốn O(k).
+    """
+
+    def __init__(self, indices, scores):
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float32)
+
+    @property
+    def k(self):
+        return self.indices.shape[1]
+
+    @classmethod
+    def build(cls, matrix, k=20, block_size=256):
+        """
+        Tính bảng hàng xóm theo từng khối hàng.
+
+        Mỗi khối chỉ tạo một ma trận dày kích thước block_size x n nên bộ nhớ
+        bị chặn trên, không phụ thuộc vào n x n.
+
+        Args:
+            matrix (csr_matrix): Ma trận TF-IDF đã chuẩn hóa L2
+            k (int): Số hàng xóm giữ lại cho mỗi phim
+            block_size (int): Số hàng xử lý trong một khối
+        """
+        n = matrix.shape[0]
+        k = max(0, min(k, n - 1))
+        indices = np.zeros((n, k), dtype=np.int32)
+        scores = np.zeros((n, k), dtype=np.float32)
+        if k == 0:
+            return cls(indices, scores)
+
+        matrix_t = matrix.T.tocsc()
+        for start in range(0, n, block_size):
+            end = min(start + block_size, n)
+            block = (matrix[start:end] @ matrix_t).toarray().astype(np.float32)
+            rows = np.arange(end - start)
+            # Loại bỏ chính phim đó khỏi danh sách hàng xóm
+            block[rows, rows + start] = -np.inf
+            part = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            part_scores = np.take_along_axis(block, part, axis=1)
+            order = np.argsort(-part_scores, axis=1, kind='stable')
+            indices[start:end] = np.take_along_axis(part, order, axis=1)
+            scores[start:end] = np.take_along_axis(part_scores, order, axis=1)
+        return cls(indices, scores)
+
+    def neighbors(self, movie_idx, top_n):
+        """Trả về (chỉ số, điểm) của top_n hàng xóm của một phim."""
+        return self.indices[movie_idx, :top_n], self.scores[movie_idx, :top_n]
+
+    def save(self, path):
+        np.savez(path, indices=self.indices, scores=self.scores)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['indices'], data['scores'])
+
+
+def catalog_hash(contents, params):
+    """Tính hash của catalog (nội dung + tham số vectorizer) để làm khóa cache."""
+    h = hashlib.sha1()
+    h.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    for text in contents:
+        h.update(text.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class TfidfRecommender:
+    """
+    Bộ gợi ý Content-Based dựa trên TF-IDF, chỉ fit một lần.
+
+    Vectorizer được fit khi khởi tạo (hoặc ma trận + vocabulary được tải từ
+    đĩa nếu hash của catalog không đổi). Mỗi truy vấn sau đó chỉ tốn một phép
+    nhân vector hàng với ma trận thưa. Nếu bật `neighbor_k`, bảng top-K hàng
+    xóm được tính sẵn và các truy vấn có top_n <= K chỉ là một lần tra bảng.
+    """
+
+    def __init__(self, df, stop_words=None, max_features=5000, ngram_range=(1, 2),
+                 cache_dir=DEFAULT_CACHE_DIR, neighbor_k=20):
+        """
+        Args:
+            df (DataFrame): DataFrame chứa dữ liệu phim (title, genres, description)
+            stop_words (list | str | None): Danh sách stopwords, mặc định đọc stopwords tiếng Việt
+            max_features (int): Số đặc trưng tối đa của TF-IDF
+            ngram_range (tuple): Khoảng n-gram
+            cache_dir (str | None): Thư mục cache trên đĩa, None để tắt cache
+            neighbor_k (int): Số hàng xóm tính sẵn cho mỗi phim, 0 để tắt bảng hàng xóm
+        """
+        if stop_words is None:
+            stop_words = load_stopwords()
+        self.df = df.reset_index(drop=True)
+        self.titles = self.df['title'].tolist()
+        self.genres = self.df['genres'].tolist()
+        self.descriptions = self.df['description'].tolist()
+        self.title_index = TitleIndex(self.titles)
+        self.params = {
+            'stop_words': stop_words,
+            'max_features': max_features,
+            'ngram_range': list(ngram_range),
+        }
+        contents = build_content(self.df)
+        self.version = catalog_hash(contents, self.params)
+        self.vectorizer = None
+        self.tfidf_matrix = None
+        self.neighbor_table = None
+
+        if cache_dir and self._load(cache_dir):
+            print(f"Đã tải ma trận TF-IDF từ cache ({self.version[:12]}).")
+        else:
+            self.vectorizer = self._new_vectorizer()
+            # TF-IDF mặc định chuẩn hóa L2 nên cosine similarity chính là tích vô hướng
+            self.tfidf_matrix = self.vectorizer.fit_transform(contents).tocsr()
+            if cache_dir:
+                self._save(cache_dir)
+
+        if neighbor_k:
+            self.neighbor_table = self._load_or_build_neighbors(cache_dir, neighbor_k)
+
+    def _new_vectorizer(self):
+        return TfidfVectorizer(
+            stop_words=self.params['stop_words'],
+            max_features=self.params['max_features'],
+            ngram_range=tuple(self.params['ngram_range'])
+        )
+
+    def _cache_paths(self, cache_dir):
+        base = os.path.join(cache_dir, f"tfidf_{self.version[:16]}")
+        return base + '.npz', base + '.json'
+
+    def _save(self, cache_dir):
+        """Lưu ma trận thưa và vocabulary/idf xuống đĩa."""
+        matrix_path, meta_path = self._cache_paths(cache_dir)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            sparse.save_npz(matrix_path, self.tfidf_matrix)
+            meta = {
+                'version': self.version,
+                'vocabulary': {term: int(i) for term, i in self.vectorizer.vocabulary_.items()},
+                'idf': self.vectorizer.idf_.tolist(),
+            }
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+        except OSError as e:
+            print(f"Không thể lưu cache TF-IDF: {e}")
+
+    def _load(self, cache_dir):
+        """Tải ma trận và vocabulary từ đĩa nếu khớp hash của catalog."""
+        matrix_path, meta_path = self._cache_paths(cache_dir)
+        if not (os.path.exists(matrix_path) and os.path.exists(meta_path)):
+            return False
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != self.version:
+                return False
+            matrix = sparse.load_npz(matrix_path).tocsr()
+            if matrix.shape[0] != len(self.titles):
+                return False
+            vectorizer = self._new_vectorizer()
+            vectorizer.vocabulary_ = meta['vocabulary']
+            vectorizer.idf_ = np.asarray(meta['idf'], dtype=np.float64)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Cache TF-IDF không hợp lệ, sẽ fit lại: {e}")
+            return False
+        self.vectorizer = vectorizer
+        self.tfidf_matrix = matrix
+        return True
+
+    def _load_or_build_neighbors(self, cache_dir, neighbor_k):
+        """Tải bảng hàng xóm từ cache hoặc tính mới."""
+        path = None
+        if cache_dir:
+            path = os.path.join(cache_dir, f"tfidf_{self.version[:16]}_neighbors_{neighbor_k}.npz")
+            if os.path.exists(path):
+                try:
+                    table = NeighborTable.load(path)
+                    if table.indices.shape[0] == len(self.titles):
+                        return table
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Bảng hàng xóm trong cache không hợp lệ, sẽ tính lại: {e}")
+
+        table = NeighborTable.build(self.tfidf_matrix, k=neighbor_k)
+        if path:
+            try:
+                table.save(path)
+            except OSError as e:
+                print(f"Không thể lưu bảng hàng xóm: {e}")
+        return table
+
+    def similarities(self, movie_idx):
+        """Độ tương đồng cosine giữa một phim và toàn bộ catalog."""
+        return (self.tfidf_matrix[movie_idx] @ self.tfidf_matrix.T).toarray().ravel()
+
+    def recommend(self, movie_title, top_n=5):
+        """
+        Gợi ý các phim tương tự với một phim.
+
+        Tên phim được tra qua chỉ mục tên nên chấp nhận cả chữ thường,
+        không dấu hoặc gõ sai nhẹ.
+
+        Args:
+            movie_title (str): Tên phim cần gợi ý
+            top_n (int): Số lượng phim gợi ý
+
+        Returns:
+            list: Danh sách các phim được gợi ý
+        """
+        movie_idx = self.title_index.lookup(movie_title)
+        if movie_idx is None:
+            return []
+
+        if self.neighbor_table is not None and top_n <= self.neighbor_table.k:
+            similar_indices, scores = self.neighbor_table.neighbors(movie_idx, top_n)
+        else:
+            similarities = self.similarities(movie_idx)
+            similarities[movie_idx] = -np.inf
+            similar_indices = top_k_indices(similarities, min(top_n, len(similarities) - 1))
+            scores = similarities[similar_indices]
+
+        return [
+            {
+                'title': self.titles[idx],
+                'genres': self.genres[idx],
+                'description': self.descriptions[idx],
+                'similarity_score': float(score)
+            }
+            for idx, score in zip(similar_indices, scores)
+        ]
+
+    def recommend_for_history(self, movie_titles, top_n=10):
+        """
+        Gợi ý "vì bạn đã xem" cho nhiều phim cùng lúc.
+
+        Độ tương đồng của tất cả phim đầu vào được tính bằng một phép nhân ma
+        trận thưa duy nhất, sau đó lấy trung bình theo từng phim trong catalog.
+        Các phim đầu vào (và phim trùng lặp) bị loại khỏi kết quả.
+
+        Args:
+            movie_titles (list): Danh sách tên phim (ví dụ lịch sử xem của người dùng)
+            top_n (int): Số lượng phim gợi ý
+
+        Returns:
+            dict: {'matched_titles', 'not_found', 'recommendations'}
+        """
+        rows, not_found = [], []
+        for title in movie_titles:
+            movie_idx = self.title_index.lookup(title)
+            if movie_idx is None:
+                not_found.append(title)
+            elif movie_idx not in rows:
+                rows.append(movie_idx)
+
+        result = {
+            'matched_titles': [self.titles[idx] for idx in rows],
+            'not_found': not_found,
+            'recommendations': []
+        }
+        if not rows:
+            return result
+
+        # (số phim đầu vào x số phim catalog), tính trong một lần nhân
+        similarities = (self.tfidf_matrix[rows] @ self.tfidf_matrix.T).toarray()
+        scores = similarities.mean(axis=0)
+        scores[rows] = -np.inf
+        top_indices = top_k_indices(scores, min(top_n, len(scores) - len(rows)))
+        # Phim đầu vào đóng góp nhiều nhất cho từng gợi ý
+        sources = similarities[:, top_indices].argmax(axis=0)
+
+        result['recommendations'] = [
+            {
+                'title': self.titles[idx],
+                'genres': self.genres[idx],
+                'description': self.descriptions[idx],
+                'similarity_score': float(scores[idx]),
+                'because_you_watched': self.titles[rows[source]]
+            }
+            for idx, source in zip(top_indices, sources)
+        ]
+        return result
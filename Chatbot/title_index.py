@@ -0,0 +1,185 @@
+import re
+import bisect
+import unicodedata
+from collections import defaultdict
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+# Ký tự ngăn cách các phần của tên phim (vd. "Boruto: Naruto Next Generations", "A | B")
+_TITLE_SEGMENT = re.compile(r'[:|(\[\]/]')
+
+
+def normalize_title(text):
+    """
+    Chuẩn hóa tên phim để so khớp: bỏ dấu tiếng Việt, chuyển về chữ thường,
+    thay ký tự đặc biệt bằng khoảng trắng.
+
+    Ví dụ: "Đảo Hải Tặc: One Piece!" -> "dao hai tac one piece"
+    """
+    if not isinstance(text, str):
+        return ''
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFD', text)
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    return _NON_ALNUM.sub(' ', text.casefold()).strip()
+
+
+def _trigrams(normalized):
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """
+    Chỉ mục tên phim -> số thứ tự dòng trong catalog.
+
+    - Tra cứu chính xác và theo tên đã chuẩn hóa: O(1) qua dict.
+    - Tra cứu theo tiền tố: tìm nhị phân trên danh sách tên đã sắp xếp.
+    - Tra cứu gần đúng (gõ sai chính tả): chỉ mục trigram, chỉ duyệt các
+      phim có chung ít nhất một trigram với truy vấn.
+    - Tìm tên phim được nhắc tới trong một câu hỏi: `mentions()`.
+    """
+
+    def __init__(self, titles, min_similarity=0.5, min_prefix_length=3, max_prefix_scan=64):
+        """
+        Args:
+            titles (list): Danh sách tên phim theo thứ tự dòng
+            min_similarity (float): Ngưỡng Jaccard trigram tối thiểu cho tra cứu gần đúng
+            min_prefix_length (int): Độ dài tối thiểu (đã chuẩn hóa) của truy vấn để tra cứu theo tiền tố
+            max_prefix_scan (int): Số tên tối đa được duyệt khi tra cứu theo tiền tố
+        """
+        self.titles = list(titles)
+        self.min_similarity = min_similarity
+        self.min_prefix_length = min_prefix_length
+        self.max_prefix_scan = max_prefix_scan
+        self._exact = {}
+        self._normalized = {}
+        self._trigram_postings = defaultdict(list)
+        self._trigram_counts = []
+
+        for row_id, title in enumerate(self.titles):
+            self._exact.setdefault(title, row_id)
+            normalized = normalize_title(title)
+            self._normalized.setdefault(normalized, row_id)
+            grams = _trigrams(normalized)
+            self._trigram_counts.append(len(grams))
+            for gram in grams:
+                self._trigram_postings[gram].append(row_id)
+
+        self._sorted_normalized = sorted(self._normalized.items())
+        self._sorted_keys = [key for key, _ in self._sorted_normalized]
+        self._phrases = None
+        self._max_phrase_words = 0
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __contains__(self, title):
+        return self.lookup(title, fuzzy=False) is not None
+
+    def _prefix_lookup(self, normalized):
+        """Tìm tên ngắn nhất bắt đầu bằng chuỗi truy vấn (bỏ qua truy vấn quá ngắn)."""
+        if len(normalized) < self.min_prefix_length:
+            return None
+        start = bisect.bisect_left(self._sorted_keys, normalized)
+        best = None
+        for key, row_id in self._sorted_normalized[start:start + self.max_prefix_scan]:
+            if not key.startswith(normalized):
+                break
+            if best is None or len(key) < len(best[0]):
+                best = (key, row_id)
+        return best[1] if best else None
+
+    def _build_phrases(self):
+        """
+        Các cụm từ dùng để nhận ra tên phim trong câu hỏi: tên đầy đủ, từng phần
+        của tên và phần đầu của mỗi phần ("naruto" trong "Naruto Next
+        Generations"). Cụm một từ chỉ được dùng nếu đủ dài và chỉ thuộc về một
+        phim, để các từ chung (vd. "season", "dragon") không bị coi là tên phim.
+        """
+        phrases = {}
+        single_words = defaultdict(set)
+        for row_id, title in enumerate(self.titles):
+            normalized = normalize_title(title)
+            if len(normalized) >= self.min_prefix_length:
+                phrases.setdefault(normalized, row_id)
+            for segment in _TITLE_SEGMENT.split(title):
+                words = normalize_title(segment).split()
+                for n in range(1, len(words) + 1):
+                    if n > 1:
+                        phrases.setdefault(' '.join(words[:n]), row_id)
+                    elif len(words[0]) >= 5 and not words[0].isdigit():
+                        single_words[words[0]].add(row_id)
+        for word, row_ids in single_words.items():
+            if len(row_ids) == 1:
+                phrases.setdefault(word, next(iter(row_ids)))
+        self._phrases = phrases
+        self._max_phrase_words = max((len(key.split()) for key in phrases), default=0)
+
+    def mentions(self, text):
+        """
+        Các phim được nhắc tới trong câu (so khớp cụm từ dài nhất trên văn bản đã chuẩn hóa).
+
+        Returns:
+            list: Số thứ tự dòng của các phim, theo thứ tự xuất hiện
+        """
+        if self._phrases is None:
+            self._build_phrases()
+        words = normalize_title(text).split()
+        found = []
+        start = 0
+        while start < len(words):
+            for end in range(min(len(words), start + self._max_phrase_words), start, -1):
+                row_id = self._phrases.get(' '.join(words[start:end]))
+                if row_id is not None:
+                    if row_id not in found:
+                        found.append(row_id)
+                    start = end
+                    break
+            else:
+                start += 1
+        return found
+
+    def _fuzzy_lookup(self, normalized):
+        """Tìm tên có độ tương đồng Jaccard trigram cao nhất."""
+        grams = _trigrams(normalized)
+        shared = defaultdict(int)
+        for gram in grams:
+            for row_id in self._trigram_postings.get(gram, ()):
+                shared[row_id] += 1
+
+        best_id, best_score = None, self.min_similarity
+        for row_id, count in shared.items():
+            score = count / (len(grams) + self._trigram_counts[row_id] - count)
+            if score > best_score or (score == best_score and best_id is None):
+                best_id, best_score = row_id, score
+        return best_id
+
+    def lookup(self, title, fuzzy=True):
+        """
+        Tìm số thứ tự dòng của một phim.
+
+        Args:
+            title (str): Tên phim người dùng nhập
+            fuzzy (bool): Cho phép tra cứu theo tiền tố và gần đúng
+
+        Returns:
+            int | None: Số thứ tự dòng, None nếu không tìm thấy
+        """
+        if title in self._exact:
+            return self._exact[title]
+        normalized = normalize_title(title)
+        if not normalized:
+            return None
+        if normalized in self._normalized:
+            return self._normalized[normalized]
+        if not fuzzy:
+            return None
+        row_id = self._prefix_lookup(normalized)
+        if row_id is None:
+            row_id = self._fuzzy_lookup(normalized)
+        return row_id
+
+    def resolve(self, title, fuzzy=True):
+        """Trả về tên phim chuẩn trong catalog, None nếu không tìm thấy."""
+        row_id = self.lookup(title, fuzzy=fuzzy)
+        return None if row_id is None else self.titles[row_id]
@@ -0,0 +1,316 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+
+def catalog_fingerprint(texts: List[str], metadatas: Optional[List[dict]] = None, extra: Optional[dict] = None) -> str:
+    """Tính dấu vân tay của dữ liệu dùng để dựng index (nội dung, metadata, tham số)."""
+    h = hashlib.sha1()
+    if extra:
+        h.update(json.dumps(extra, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    for i, text in enumerate(texts):
+        h.update(text.encode('utf-8'))
+        h.update(b'\0')
+        if metadatas:
+            h.update(json.dumps(metadatas[i], sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+            h.update(b'\0')
+    return h.hexdigest()
+
+
+def model_dir_name(model_name: str) -> str:
+    """Chuyển tên model embedding thành tên thư mục hợp lệ."""
+    return re.sub(r'[^0-9A-Za-z._-]+', '__', model_name)
+
+
+def load_faiss_index(path: str, embeddings) -> Optional[FAISS]:
+    """Tải FAISS index đã lưu, trả về None nếu chưa có hoặc bị lỗi."""
+    if not os.path.exists(os.path.join(path, "index.faiss")):
+        return None
+    try:
+        return FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    except Exception as e:
+        print(f"Không thể tải index tại {path}: {str(e)}")
+        return None
+
+
+INDEX_MANIFEST_FILE = "manifest.json"
+DEFAULT_EMBED_BATCH_SIZE = 64
+
+
+def embed_texts_batched(embeddings, texts: List[str], model_name: str = '', batch_size: int = DEFAULT_EMBED_BATCH_SIZE,
+                        workers: Optional[int] = None, checkpoint_dir: Optional[str] = None) -> np.ndarray:
+    """
+    Embed nhiều văn bản theo lô, song song trên nhiều lõi CPU và có checkpoint.
+
+    - Văn bản được sắp xếp theo độ dài trước khi chia lô để giảm padding.
+    - Các lô chạy trên một thread pool; trong lúc embed, số thread của torch
+      được chia đều cho các worker để tổng số luồng không vượt quá số lõi,
+      sau đó được trả lại như cũ.
+    - Mỗi lô xong được lưu thành file .npy trong `checkpoint_dir`; nếu quá trình
+      bị gián đoạn, lần chạy sau chỉ embed các lô còn thiếu.
+
+    Args:
+        embeddings: Model embedding (có embed_documents)
+        texts: Danh sách văn bản
+        model_name: Tên model, dùng làm khóa checkpoint
+        batch_size: Số văn bản mỗi lô
+        workers: Số worker, mặc định bằng số lõi CPU
+        checkpoint_dir: Thư mục checkpoint, None để tắt
+
+    Returns:
+        np.ndarray: Ma trận (len(texts), số chiều) theo đúng thứ tự đầu vào
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, min(workers or cpu_count, cpu_count))
+
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+    job_dir = None
+    if checkpoint_dir:
+        job_key = catalog_fingerprint(texts, extra={'model': model_name, 'batch_size': batch_size})
+        job_dir = os.path.join(checkpoint_dir, job_key[:16])
+        os.makedirs(job_dir, exist_ok=True)
+
+    results = [None] * len(batches)
+    pending = []
+    for batch_no in range(len(batches)):
+        batch_path = os.path.join(job_dir, f"batch_{batch_no:05d}.npy") if job_dir else None
+        if batch_path and os.path.exists(batch_path):
+            results[batch_no] = np.load(batch_path)
+        else:
+            pending.append(batch_no)
+    if len(pending) < len(batches):
+        print(f"Tiếp tục từ checkpoint: {len(batches) - len(pending)}/{len(batches)} lô đã có sẵn")
+
+    def run_batch(batch_no):
+        vectors = np.asarray(embeddings.embed_documents([texts[i] for i in batches[batch_no]]), dtype=np.float32)
+        if job_dir:
+            np.save(os.path.join(job_dir, f"batch_{batch_no:05d}.npy"), vectors)
+        return batch_no, vectors
+
+    done = len(batches) - len(pending)
+    # Số thread torch là thiết lập toàn tiến trình: trả lại sau khi embed để truy vấn
+    # và sinh câu trả lời về sau không bị giới hạn
+    torch_threads = torch.get_num_threads() if torch is not None else None
+    if torch is not None:
+        torch.set_num_threads(max(1, cpu_count // workers))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_batch, batch_no) for batch_no in pending]
+            for future in as_completed(futures):
+                batch_no, vectors = future.result()
+                results[batch_no] = vectors
+                done += 1
+                print(f"Đã embed {done}/{len(batches)} lô ({len(texts)} đoạn văn bản)")
+    finally:
+        if torch_threads is not None:
+            torch.set_num_threads(torch_threads)
+
+    matrix = np.empty((len(texts), results[0].shape[1]), dtype=np.float32)
+    for batch, vectors in zip(batches, results):
+        matrix[batch] = vectors
+    if job_dir:
+        shutil.rmtree(job_dir, ignore_errors=True)
+    return matrix
+
+
+def embedding_dimension(embeddings) -> int:
+    """Số chiều vector của model embedding (embed thử một câu ngắn)."""
+    return len(embeddings.embed_query("kiểm tra số chiều"))
+
+
+def embedding_normalized(embeddings) -> bool:
+    """Model embedding có chuẩn hóa L2 vector đầu ra hay không."""
+    return bool((getattr(embeddings, 'encode_kwargs', None) or {}).get('normalize_embeddings', False))
+
+
+def write_index_manifest(path: str, vector_store: FAISS, model_name: str, embeddings):
+    """Ghi manifest mô tả index (model, số chiều, chuẩn hóa, số tài liệu, thời điểm dựng) cạnh index.faiss."""
+    manifest = {
+        'model_name': model_name,
+        'dimension': vector_store.index.d,
+        'normalize_embeddings': embedding_normalized(embeddings),
+        'document_count': vector_store.index.ntotal,
+        'built_at': datetime.now(timezone.utc).isoformat()
+    }
+    with open(os.path.join(path, INDEX_MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def read_index_manifest(path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(path, INDEX_MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def validate_index_manifest(path: str, model_name: str, embeddings) -> Optional[str]:
+    """
+    Kiểm tra index đã lưu có được dựng bằng đúng model embedding đang dùng để truy vấn.
+
+    Returns:
+        str | None: Lý do không khớp, None nếu index hợp lệ
+    """
+    manifest = read_index_manifest(path)
+    if manifest is None:
+        return "không có manifest"
+    if manifest.get('model_name') != model_name:
+        return f"index được dựng bằng model '{manifest.get('model_name')}', đang dùng '{model_name}'"
+    if manifest.get('normalize_embeddings') != embedding_normalized(embeddings):
+        return "cấu hình chuẩn hóa embedding không khớp"
+    dimension = embedding_dimension(embeddings)
+    if manifest.get('dimension') != dimension:
+        return f"số chiều index {manifest.get('dimension')} khác số chiều model {dimension}"
+    return None
+
+
+class IncrementalIndexer:
+    """
+    Cập nhật FAISS index theo movie_id thay vì dựng lại toàn bộ.
+
+    Một manifest (movie_manifest.json) lưu cạnh index ghi lại hash nội dung và
+    danh sách id chunk của từng phim. Mỗi lần đồng bộ chỉ embed các phim mới
+    hoặc đã thay đổi, và xóa vector của phim đã bị loại khỏi catalog qua
+    ánh xạ id -> vị trí trong index.
+    """
+
+    MANIFEST_FILE = "movie_manifest.json"
+
+    def __init__(self, path: str, model_name: str, embeddings, text_splitter, settings: Optional[dict] = None,
+                 batch_size: int = DEFAULT_EMBED_BATCH_SIZE, workers: Optional[int] = None):
+        """
+        Args:
+            path: Thư mục lưu index và manifest
+            model_name: Tên model embedding (ghi vào manifest của index)
+            embeddings: Model embedding
+            text_splitter: Bộ chia chunk (dùng split_text)
+            settings: Tham số ảnh hưởng đến vector (model, chunk_size...), thay đổi sẽ dựng lại toàn bộ
+            batch_size: Số đoạn văn bản mỗi lô embed
+            workers: Số worker embed song song, mặc định bằng số lõi CPU
+        """
+        self.path = path
+        self.model_name = model_name
+        self.embeddings = embeddings
+        self.text_splitter = text_splitter
+        self.settings = settings or {}
+        self.batch_size = batch_size
+        self.workers = workers
+        self.checkpoint_dir = os.path.join(path, ".checkpoints")
+
+    @staticmethod
+    def record_hash(text: str, metadata: dict) -> str:
+        payload = text + '\0' + json.dumps(metadata, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.path, self.MANIFEST_FILE)
+
+    def load_manifest(self) -> Optional[dict]:
+        try:
+            with open(self._manifest_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, vector_store: FAISS, manifest: dict):
+        os.makedirs(self.path, exist_ok=True)
+        vector_store.save_local(self.path)
+        write_index_manifest(self.path, vector_store, self.model_name, self.embeddings)
+        # Ghi manifest sau index để manifest không bao giờ mô tả một index chưa được lưu
+        tmp_path = self._manifest_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self._manifest_path())
+
+    @property
+    def fingerprint(self) -> Optional[str]:
+        """Dấu vân tay của catalog đang được index (thay đổi mỗi khi index được cập nhật)."""
+        manifest = self.load_manifest()
+        return manifest.get('fingerprint') if manifest else None
+
+    def sync(self, records: Dict[str, Tuple[str, dict]]) -> Tuple[Optional[FAISS], dict]:
+        """
+        Đồng bộ index với catalog hiện tại.
+
+        Args:
+            records: {movie_id: (văn bản, metadata)}
+
+        Returns:
+            tuple: (vector store, thống kê {'added', 'updated', 'removed', 'unchanged'})
+        """
+        manifest = self.load_manifest()
+        vector_store = None
+        if manifest and manifest.get('settings') == self.settings:
+            mismatch = validate_index_manifest(self.path, self.model_name, self.embeddings)
+            if mismatch:
+                print(f"Index tại {self.path} không dùng được ({mismatch}), sẽ dựng lại toàn bộ.")
+            else:
+                vector_store = load_faiss_index(self.path, self.embeddings)
+        if vector_store is None:
+            manifest = None
+        movies = manifest['movies'] if manifest else {}
+
+        hashes = {movie_id: self.record_hash(text, metadata) for movie_id, (text, metadata) in records.items()}
+        removed = [movie_id for movie_id in movies if movie_id not in records]
+        changed = [movie_id for movie_id in records if movie_id in movies and movies[movie_id]['hash'] != hashes[movie_id]]
+        added = [movie_id for movie_id in records if movie_id not in movies]
+        stats = {
+            'added': len(added),
+            'updated': len(changed),
+            'removed': len(removed),
+            'unchanged': len(records) - len(added) - len(changed)
+        }
+        if not (removed or changed or added):
+            return vector_store, stats
+
+        # Xóa vector của phim bị loại bỏ hoặc đã thay đổi nội dung
+        stale_ids = [chunk_id for movie_id in removed + changed for chunk_id in movies[movie_id]['chunk_ids']]
+        if stale_ids:
+            vector_store.delete(stale_ids)
+        for movie_id in removed:
+            del movies[movie_id]
+
+        texts, metadatas, ids = [], [], []
+        for movie_id in changed + added:
+            text, metadata = records[movie_id]
+            chunks = self.text_splitter.split_text(text)
+            chunk_ids = [f"{movie_id}#{i}" for i in range(len(chunks))]
+            texts.extend(chunks)
+            metadatas.extend([metadata] * len(chunks))
+            ids.extend(chunk_ids)
+            movies[movie_id] = {'hash': hashes[movie_id], 'chunk_ids': chunk_ids}
+
+        if texts:
+            vectors = embed_texts_batched(
+                self.embeddings, texts, model_name=self.model_name, batch_size=self.batch_size,
+                workers=self.workers, checkpoint_dir=self.checkpoint_dir
+            )
+            text_embeddings = list(zip(texts, vectors.tolist()))
+            if vector_store is None:
+                vector_store = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas, ids=ids)
+            else:
+                vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+
+        if vector_store is not None:
+            fingerprint = catalog_fingerprint(sorted(movie['hash'] for movie in movies.values()), extra=self.settings)
+            self._save(vector_store, {'settings': self.settings, 'fingerprint': fingerprint, 'movies': movies})
+        return vector_store, stats